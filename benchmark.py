@@ -0,0 +1,582 @@
+import os
+import sys
+import csv
+import json
+import time
+import random
+import shutil
+import socket
+import threading
+import http.client
+import urllib.parse
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+from collections import Counter
+
+# 各项性能基准：python benchmark.py <子命令>
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def bench_startup(args):
+    """冷启动：从进程启动到窗口首次绘制、到第一次识别完成的耗时"""
+    results = []
+    for i in range(args.runs):
+        t0 = time.time()
+        proc = subprocess.run([sys.executable, os.path.join(HERE, "stzb.py"), "--startup-probe"],
+                              cwd=HERE, capture_output=True, text=True, encoding="utf-8")
+        line = next((l for l in proc.stdout.splitlines() if l.startswith("{")), None)
+        if not line:
+            print(f"❌ 第 {i + 1} 次启动失败:\n{proc.stderr[-2000:]}")
+            return
+        marks = json.loads(line)
+        if "error" in marks:
+            print(f"❌ OCR 引擎加载失败: {marks['error']}")
+            return
+        results.append((marks["window"] - t0, marks["first_recognition"] - t0))
+        print(f"第 {i + 1} 次: 首个窗口 {results[-1][0]:.2f}s | 首次识别 {results[-1][1]:.2f}s")
+
+    print("\n" + "=" * 40)
+    print(f"首个窗口 平均 {sum(r[0] for r in results) / len(results):.2f}s，最快 {min(r[0] for r in results):.2f}s")
+    print(f"首次识别 平均 {sum(r[1] for r in results) / len(results):.2f}s，最快 {min(r[1] for r in results):.2f}s")
+    print("=" * 40)
+
+
+def _synthetic_csv(path, rows, players):
+    """生成与导出格式一致的合成 CSV：players 个玩家，rows 条阵容记录"""
+    sys.path.insert(0, HERE)
+    import stzb
+    pool = stzb.GENERAL_MATCHER.pool
+    factions = list(stzb.FACTION_MAP)
+    names = [f"玩家{i:07d}" for i in range(players)]
+    rnd = random.Random(42)
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        w = stzb.csv.writer(f)
+        w.writerow(['玩家名称', '是否白名单', '记录时间', '大营', '中军', '前锋', '备注'])
+        for i in range(rows):
+            gens = [f"{rnd.choice(factions)} · {rnd.choice(pool)}" for _ in range(3)]
+            w.writerow([rnd.choice(names), "是" if i % 97 == 0 else "否",
+                        f"2025-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d} 12:00:00", *gens, "" if i % 5 else "备注"])
+
+
+def bench_import(args):
+    """导入/导出吞吐：合成 CSV 导入空库，再整库导出（行/秒）"""
+    sys.path.insert(0, HERE)
+    import stzb
+    tmp = tempfile.mkdtemp(prefix="stzb_bench_")
+    try:
+        src, out, db_path = (os.path.join(tmp, n) for n in ("in.csv", "out.csv", "bench.db"))
+        t = time.perf_counter()
+        _synthetic_csv(src, args.rows, args.players)
+        print(f"生成 {args.rows} 行合成数据: {time.perf_counter() - t:.1f}s ({os.path.getsize(src) / 1e6:.0f} MB)")
+
+        db = stzb.DatabaseManager(db_path)
+        t = time.perf_counter()
+        ok, msg = db.import_from_csv(src, chunk_size=args.chunk)
+        dt = time.perf_counter() - t
+        print(f"导入: {msg} | {dt:.1f}s | {args.rows / dt:,.0f} 行/秒")
+
+        t = time.perf_counter()
+        ok, msg = db.export_to_csv(out)
+        dt = time.perf_counter() - t
+        print(f"导出: {msg} | {dt:.1f}s | {args.rows / dt:,.0f} 行/秒")
+        db.close()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def bench_replay(args):
+    """离线回放：把 stzb.py --record 录下的画面逐帧送入完整监控流程（门控、OCR、武将匹配、玩家名判定、入库），
+    输出各阶段耗时分位数、吞吐，以及与 labels.json 真值对比的识别准确率。无需屏幕，可在 Linux 上运行"""
+    sys.path.insert(0, HERE)
+    import stzb
+    source = stzb.ReplaySource(args.recording, loop=args.loop)
+    tmp = tempfile.mkdtemp(prefix="stzb_replay_")
+    try:
+        db = stzb.DatabaseManager(os.path.join(tmp, "replay.db"))
+        t = time.perf_counter()
+        engine = stzb.RecognitionEngine(fast_mode=args.ocr_mode != "full", backend=args.backend, workers=args.workers,
+                                        gate_cfg={"icon_template": os.path.join(tmp, "icon_template.png")})
+        engine.ready_event.wait()
+        if not engine.ready:
+            print(f"❌ OCR 引擎加载失败: {engine.state_detail}")
+            return
+        print(f"引擎就绪: {time.perf_counter() - t:.1f}s（{args.backend}，进程 {args.workers}，{args.ocr_mode}）")
+
+        pipeline = stzb.MonitorPipeline(engine, db, source, {})
+        # 整个回放都留在窗口里，分位数覆盖全部样本
+        stzb.METRICS.window = 10 ** 7
+        stzb.METRICS.reset()
+        states, results = Counter(), {}
+        t0 = time.perf_counter()
+        while True:
+            state = pipeline.tick()
+            if source.exhausted: break
+            states[state] += 1
+            if pipeline.last_report and source.current["file"] not in results:
+                results[source.current["file"]] = pipeline.last_report
+        db.flush()
+        total = time.perf_counter() - t0
+        dedup_hits = db.recent.hits
+        engine.close()
+        db.close()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    snap = stzb.METRICS.snapshot()
+    ticks = sum(states.values())
+    fmt = lambda v: f"{v:>10.1f}" if v is not None else f"{'-':>10}"
+    print("\n" + "=" * 72)
+    print(f"{'stage':<14}{'count':>8}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}{'errors':>8}  (ms)")
+    for stage, st in snap.items():
+        print(f"{stage:<14}{st['count']:>8}" + "".join(fmt(st[q]) for q in ("p50", "p90", "p99", "max")) + f"{st['errors']:>8}")
+        if st["last_error"]: print(f"{'':<14}最近错误: {st['last_error']}")
+    print("-" * 72)
+    print(f"帧数 {ticks} | 总耗时 {total:.1f}s | 吞吐 {ticks / total:.1f} 帧/秒 | "
+          f"OCR {snap.get('recognize', {}).get('count', 0)} 次 | 入库 {states['saved']} 条 | 重复跳过 {dedup_hits} 次")
+    print("状态分布: " + ", ".join(f"{k} {v}" for k, v in states.most_common()))
+
+    labelled = [(results[f], lab) for f, lab in source.labels.items() if f in results]
+    if labelled:
+        player_ok = sum(r[0] == lab["player"] for r, lab in labelled)
+        gen_total = sum(len(lab["generals"]) for _, lab in labelled)
+        gen_ok = sum(a == b for r, lab in labelled for a, b in zip(r[1], lab["generals"]))
+        full_ok = sum(r[0] == lab["player"] and list(r[1]) == list(lab["generals"]) for r, lab in labelled)
+        print(f"准确率（{len(labelled)} 张有标注的战报）: 玩家名 {player_ok / len(labelled):.1%} | "
+              f"武将 {gen_ok / max(gen_total, 1):.1%} | 整张战报 {full_ok / len(labelled):.1%}")
+    if args.seed_labels:
+        # 用本次识别结果为尚未标注的战报生成标注草稿，人工校对 labels.json 后即可作为真值
+        labels = dict(source.labels)
+        for f, (p_name, teams) in results.items(): labels.setdefault(f, {"player": p_name, "generals": list(teams)})
+        with open(os.path.join(args.recording, "labels.json"), "w", encoding="utf-8") as f:
+            json.dump(labels, f, ensure_ascii=False, indent=1)
+        print(f"已写入 {len(labels)} 条标注到 labels.json，请人工校对")
+    print("=" * 72)
+
+
+def bench_calibrate(args):
+    """为玩家名/武将两类区域挑选预处理参数：在有标注的录制帧上逐个试候选配置，
+    准确率不低于默认配置的候选中取单个区域识别耗时最低者；--write-config 写入 config.json"""
+    sys.path.insert(0, HERE)
+    import stzb
+    source = stzb.ReplaySource(args.recording)
+    if not source.labels:
+        print("❌ 需要 labels.json（可先用 replay --seed-labels 生成草稿并人工校对）")
+        return
+    # 每张有标注的战报取一次各区域的像素
+    samples, seen = [], set()
+    for e in source.entries:
+        if e["file"] in seen or e["file"] not in source.labels: continue
+        seen.add(e["file"])
+        frame, regs, label = source.frame(e), e["regions"], source.labels[e["file"]]
+        samples.append(("name", frame.crop(regs["name_reg"]).copy(), label["player"]))
+        samples += [("gen", frame.crop(r).copy(), g) for r, g in zip(regs["gen_regs"], label["generals"])]
+    print(f"标注战报 {len(seen)} 张，区域样本 {len(samples)} 个")
+
+    tmp = tempfile.mkdtemp(prefix="stzb_calib_")
+    try:
+        engine = stzb.RecognitionEngine(fast_mode=args.ocr_mode != "full", backend=args.backend,
+                                        gate_cfg={"icon_template": os.path.join(tmp, "icon_template.png")})
+        engine.ready_event.wait()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    if not engine.ready:
+        print(f"❌ OCR 引擎加载失败: {engine.state_detail}")
+        return
+
+    candidates = [{}] + [{"mode": m, "trim": t, "text_height": h}
+                         for m in ("gray", "binary") for t in ("", "x", "xy") for h in (0, 24, 32, 48)]
+    chosen = {}
+    for kind in ("name", "gen"):
+        subset = [(img, truth) for k, img, truth in samples if k == kind]
+        rows = []
+        for cand in candidates:
+            engine.set_preprocess({kind: cand})
+            times, correct = [], 0
+            for r in range(args.rounds):
+                for img, truth in subset:
+                    t = time.perf_counter()
+                    text = engine.recognize(img, is_player=kind == "name")
+                    times.append(time.perf_counter() - t)
+                    if r == 0: correct += text == truth
+            times.sort()
+            rows.append((times[len(times) // 2] * 1000, correct / len(subset), cand))
+        base_acc = rows[0][1]
+        print(f"\n【{'玩家名' if kind == 'name' else '武将'}】默认配置准确率 {base_acc:.1%}，耗时 {rows[0][0]:.1f}ms")
+        for ms, acc, cand in sorted(rows, key=lambda x: x[0])[:args.top]:
+            print(f"  {ms:>7.1f}ms  {acc:>6.1%}  {json.dumps(cand) if cand else '默认'}")
+        best = min((r for r in rows if r[1] >= base_acc), key=lambda x: x[0])
+        chosen[kind] = dict(stzb.PREPROCESS_DEFAULTS, **best[2])
+        print(f"  => 选用 {json.dumps(chosen[kind])}（{best[0]:.1f}ms，准确率 {best[1]:.1%}）")
+    engine.close()
+
+    if args.write_config:
+        path = os.path.join(HERE, "config.json")
+        cfg = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f: cfg = json.load(f)
+        cfg["preprocess"] = chosen
+        with open(path, "w", encoding="utf-8") as f: json.dump(cfg, f, ensure_ascii=False)
+        print(f"\n已写入 {path}")
+
+
+def bench_cache(args):
+    """阵容缓存：查看玩家时未命中（读库）与命中（内存）的耗时，缓存每条阵容实际占用的内存（tracemalloc）
+    与缓存自身的估算值对比，以及限定内存上限时的淘汰情况"""
+    sys.path.insert(0, HERE)
+    import stzb
+    tmp = tempfile.mkdtemp(prefix="stzb_cache_")
+    try:
+        db_path = args.db
+        if not db_path:
+            src, db_path = os.path.join(tmp, "in.csv"), os.path.join(tmp, "bench.db")
+            _synthetic_csv(src, args.rows, args.players)
+            db = stzb.DatabaseManager(db_path)
+            db.import_from_csv(src)
+            db.close()
+        db = stzb.DatabaseManager(db_path, cache_bytes=1 << 40)
+        names = db.get_all_player_names()
+        rnd = random.Random(3)
+        sample = rnd.sample(names, min(args.sample, len(names)))
+
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        miss = []
+        for name in sample:
+            t = time.perf_counter(); db.get_teams(name); miss.append((time.perf_counter() - t) * 1000)
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        hit = []
+        for name in sample:
+            t = time.perf_counter(); db.get_teams(name); hit.append((time.perf_counter() - t) * 1000)
+        st = db.teams_cache.stats()
+
+        t = time.perf_counter()
+        for _ in range(args.searches): db.search_players(rnd.choice(sample)[-3:])
+        search_first = (time.perf_counter() - t) * 1000 / args.searches
+        terms = [rnd.choice(sample)[-3:] for _ in range(8)]
+        for term in terms: db.search_players(term)
+        t = time.perf_counter()
+        for _ in range(args.searches): db.search_players(rnd.choice(terms))
+        search_memo = (time.perf_counter() - t) * 1000 / args.searches
+
+        capped = stzb.TeamCache(db._load_teams, max_bytes=st["bytes"] // 4)
+        for name in sample: capped.get(name)
+        cst = capped.stats()
+        db.close()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    miss.sort(); hit.sort()
+    print("\n" + "=" * 64)
+    print(f"查看玩家 {len(sample)} 名（共 {st['teams']} 条阵容）")
+    print(f"  未命中（读库）  p50 {_percentile(miss, 0.5):.3f}ms  p99 {_percentile(miss, 0.99):.3f}ms")
+    print(f"  命中（内存）    p50 {_percentile(hit, 0.5):.4f}ms  p99 {_percentile(hit, 0.99):.4f}ms")
+    print(f"  每条阵容内存：实测 {used / max(1, st['teams']):.0f} 字节（含索引结构与武将名），缓存估算 {st['bytes_per_team']} 字节")
+    print(f"检索：首次 {search_first:.3f}ms/次，重复关键字 {search_memo:.4f}ms/次")
+    print(f"上限 {st['bytes'] // 4 / (1 << 20):.1f}MB：保留 {cst['players']} 名玩家，估算 {cst['bytes'] / (1 << 20):.1f}MB，淘汰 {cst['evictions']} 次")
+    print("=" * 64)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        super().__init__("localhost")
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.unix_path)
+
+
+def _percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))] if sorted_values else 0.0
+
+
+def _in_range(time_text, params):
+    """时间前缀的区间语义：since 含、until 不含，按前缀长度截取后比较"""
+    if "since" in params: return time_text[:len(params["since"])] >= params["since"]
+    return time_text[:len(params["until"])] < params["until"]
+
+
+def bench_query(args):
+    """查询服务压测：并发客户端（长连接）按玩家 / 武将组合 / 全文检索 / 时间范围混合查询，
+    玩家阵容翻完全部分页。输出请求/秒、延迟分位数与缓存命中率。
+    不给 --url / --unix 时用合成数据建库并自动启动 stzb.py --serve；--writes 同时以给定速率写库，检验缓存失效"""
+    sys.path.insert(0, HERE)
+    import stzb
+    tmp, proc, writer = tempfile.mkdtemp(prefix="stzb_query_"), None, None
+    try:
+        if args.url or args.unix:
+            db_path = args.db
+        else:
+            db_path = args.db or os.path.join(tmp, "bench.db")
+            if not args.db:
+                src = os.path.join(tmp, "in.csv")
+                _synthetic_csv(src, args.rows, args.players)
+                db = stzb.DatabaseManager(db_path)
+                db.import_from_csv(src)
+                db.close()
+            with socket.socket() as s:
+                s.bind(("127.0.0.1", 0))
+                port = s.getsockname()[1]
+            proc = subprocess.Popen([sys.executable, os.path.join(HERE, "stzb.py"), "--serve", "--db", db_path,
+                                     "--port", str(port), "--pool", str(args.pool)], cwd=HERE, stdout=subprocess.PIPE)
+            proc.stdout.readline()  # 启动完成提示
+            args.url = f"http://127.0.0.1:{port}"
+
+        def connect():
+            if args.unix: return _UnixHTTPConnection(args.unix)
+            u = urllib.parse.urlsplit(args.url)
+            return http.client.HTTPConnection(u.hostname, u.port or 80)
+
+        def get(conn, path, **params):
+            conn.request("GET", path + "?" + urllib.parse.urlencode(params, doseq=True))
+            resp = conn.getresponse()
+            body = resp.read()
+            return resp.status, json.loads(body)
+
+        conn = connect()
+        players = [p["name"] for p in get(conn, "/players", limit=500)[1]["items"]]
+        teams = get(conn, "/teams", limit=500)[1]["items"]
+        if not players or not teams:
+            print("❌ 数据库为空")
+            return
+        months = sorted({t["time"][:7] for t in teams})
+        years = sorted({m[:4] for m in months})
+        # 只写年份的边界要按文本比较：库里最晚的年份之后一年，since 应一条不返回、until 应包含全部
+        years.append(str(int(years[-1]) + 1))
+        stats0 = get(conn, "/stats")[1]
+        conn.close()
+
+        rnd = random.Random(7)
+        def pick():
+            kind = rnd.random()
+            if kind < 0.5: return "player", "/teams", {"player": rnd.choice(players)}
+            if kind < 0.75:
+                team = rnd.choice(teams)["team"]
+                return "general", "/teams", {"general": [stzb.split_general(g)[1] for g in rnd.sample(team, 2)]}
+            if kind < 0.9: return "search", "/players", {"q": rnd.choice(players)[-3:], "limit": 20}
+            bound = rnd.choice(months) if rnd.random() < 0.5 else rnd.choice(years)
+            return "range", "/teams", {rnd.choice(("since", "until")): bound, "limit": 100}
+
+        if args.writes > 0 and db_path:
+            stop_writes = threading.Event()
+            def write_loop():
+                db = stzb.DatabaseManager(db_path)
+                while not stop_writes.wait(1 / args.writes):
+                    db.save_record(rnd.choice(players), [rnd.choice(teams)["team"][0], "魏 · 曹操", "蜀 · 刘备"])
+                db.close()
+            writer = threading.Thread(target=write_loop, daemon=True)
+            writer.start()
+
+        latencies, errors = {}, Counter()
+        deadline = time.perf_counter() + args.duration
+        def client():
+            conn, local = connect(), {}
+            while time.perf_counter() < deadline:
+                kind, path, params = pick()
+                cursor = None
+                while True:
+                    t = time.perf_counter()
+                    try:
+                        status, body = get(conn, path, **dict(params, **({"cursor": cursor} if cursor else {})))
+                    except (OSError, http.client.HTTPException, ValueError):
+                        errors[kind] += 1; conn.close(); conn = connect(); break
+                    local.setdefault(kind, []).append((time.perf_counter() - t) * 1000)
+                    if status != 200: errors[kind] += 1; break
+                    if kind == "range" and not all(_in_range(t["time"], params) for t in body["items"]): errors[kind] += 1
+                    cursor = body["next"] if kind == "player" else None
+                    if not cursor: break
+            conn.close()
+            for kind, values in local.items():
+                latencies.setdefault(kind, []).extend(values)
+        threads = [threading.Thread(target=client) for _ in range(args.clients)]
+        t0 = time.perf_counter()
+        for th in threads: th.start()
+        for th in threads: th.join()
+        total = time.perf_counter() - t0
+        if writer: stop_writes.set(); writer.join()
+        conn = connect()
+        stats1 = get(conn, "/stats")[1]
+        conn.close()
+    finally:
+        if proc: proc.terminate(); proc.wait()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    print("\n" + "=" * 64)
+    print(f"{'query':<10}{'count':>8}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}{'errors':>8}  (ms)")
+    everything = []
+    for kind, values in sorted(latencies.items()):
+        values.sort()
+        everything += values
+        print(f"{kind:<10}{len(values):>8}" + "".join(f"{_percentile(values, q):>10.2f}" for q in (0.5, 0.9, 0.99))
+              + f"{values[-1]:>10.2f}{errors[kind]:>8}")
+    everything.sort()
+    hits, misses = stats1["hits"] - stats0["hits"], stats1["misses"] - stats0["misses"]
+    print("-" * 64)
+    print(f"客户端 {args.clients} | {len(everything) / total:,.0f} 请求/秒 | p99 {_percentile(everything, 0.99):.2f}ms | "
+          f"缓存命中 {hits / max(1, hits + misses):.1%} | 缓存作废 {stats1['generation'] - stats0['generation']} 次")
+    print("=" * 64)
+
+
+def _text_img(text, size=(160, 34)):
+    """白字深底的单行文字图，模拟战报上的一个区域"""
+    import numpy as np, cv2
+    img = np.full((size[1], size[0], 3), 30, np.uint8)
+    cv2.putText(img, text, (4, size[1] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (230, 230, 230), 2)
+    return img
+
+
+def check_gate(stzb):
+    """整张战报的变化门：只有玩家名区域改了一个字（其余三个武将区域不变）也必须重新识别"""
+    gate, calls = stzb.ChangeGate(), []
+    gens = [_text_img(g, (120, 30)) for g in ("Cao Cao", "Liu Bei", "Sun Quan")]
+    compute = lambda *imgs: calls.append(len(imgs)) or len(calls)
+    gate.cached("report", [_text_img("abcdefgh")] + gens, compute)
+    _, changed_same = gate.cached("report", [_text_img("abcdefgh")] + gens, compute)
+    _, changed_name = gate.cached("report", [_text_img("abcdefgb")] + gens, compute)
+    return [("画面不变时复用上次结果", not changed_same),
+            ("只改玩家名的一个字时重新识别", changed_name and len(calls) == 2)]
+
+
+def _blank_cells_csv(path):
+    """含空白武将格子的导出格式 CSV：整格留空、只有阵营没有武将名、整队只有一名武将"""
+    rows = [["甲", "否", "2025-03-01 10:00:00", "", "魏 · 曹操", "蜀 · 刘备", ""],
+            ["乙", "是", "2025-03-02 10:00:00", "吴 · ", "", "吴 · 孙权", "备注"],
+            ["丙", "否", "2025-03-03 10:00:00", "", "", "群 · 吕布", ""],
+            ["丙", "否", "2025-03-04 10:00:00", "魏 · 曹操", "吴 · 孙权", "蜀 · 刘备", ""]]
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        w = csv.writer(f)
+        w.writerow(['玩家名称', '是否白名单', '记录时间', '大营', '中军', '前锋', '备注'])
+        w.writerows(rows)
+
+
+def check_stats(stzb):
+    """统计表：导入含空白格子的 CSV、改阵容清空一格、监控写入补齐的 "未知" 之后，整体重算与增量维护一致，空白武将不计入"""
+    tmp = tempfile.mkdtemp(prefix="stzb_check_")
+    try:
+        src = os.path.join(tmp, "in.csv")
+        _blank_cells_csv(src)
+        db = stzb.DatabaseManager(os.path.join(tmp, "check.db"))
+        db.import_from_csv(src)
+        team_hash = db.get_teams("丙")[0].team_hash
+        db.update_team(team_hash, ["魏 · 曹操", "", "蜀 · 刘备"], "")
+        db.save_record("丁", ["魏 · 曹操"]).result()
+        generals, pairs = db.top_generals(100), db.top_pairs(100)
+        drift = db.rebuild_stats()
+        db.close()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return [("重算与增量维护无差异", not any(drift.values())),
+            ("空白武将不进武将排行", all(g not in ("", "未知") for g, _, _ in generals)),
+            ("空白武将不进同阵组合", all("" not in (a, b) and "未知" not in (a, b) for a, b, _ in pairs))]
+
+
+def check_roundtrip(stzb):
+    """导出再导入：含空白格子的阵容哈希不变，不新增任何记录"""
+    tmp = tempfile.mkdtemp(prefix="stzb_check_")
+    try:
+        src, out = os.path.join(tmp, "in.csv"), os.path.join(tmp, "out.csv")
+        _blank_cells_csv(src)
+        db = stzb.DatabaseManager(os.path.join(tmp, "check.db"))
+        db.import_from_csv(src)
+        db.save_record("丁", ["魏 · 曹操"]).result()
+        hashes = lambda: {r[0] for r in db._reader().execute("SELECT team_hash FROM teams")}
+        before = hashes()
+        db.export_to_csv(out)
+        db.import_from_csv(out)
+        after = hashes()
+        db.close()
+        db = stzb.DatabaseManager(os.path.join(tmp, "fresh.db"))
+        db.import_from_csv(out)
+        fresh = hashes()
+        db.close()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return [("导出的文件导回原库不新增记录", after == before),
+            ("导出的文件导入空库得到相同的阵容哈希", fresh == before)]
+
+
+CHECKS = {"gate": check_gate, "stats": check_stats, "roundtrip": check_roundtrip}
+
+
+def run_checks(args):
+    """正确性自检（无界面）：逐项打印结果，有失败项时退出码为 1"""
+    sys.path.insert(0, HERE)
+    import stzb
+    unknown = [n for n in args.only if n not in CHECKS]
+    if unknown:
+        print(f"❌ 没有这些检查项: {', '.join(unknown)}")
+        sys.exit(2)
+    failed = 0
+    for name in args.only or list(CHECKS):
+        for what, ok in CHECKS[name](stzb):
+            print(f"{'✅' if ok else '❌'} [{name}] {what}")
+            failed += not ok
+    print(f"\n{'全部通过' if not failed else f'{failed} 项失败'}")
+    if failed: sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="率土情报管家 性能基准")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("startup", help="冷启动耗时（需要图形界面）")
+    p.add_argument("--runs", type=int, default=3)
+    p.set_defaults(func=bench_startup)
+
+    p = sub.add_parser("import", help="CSV 导入/导出吞吐（无界面）")
+    p.add_argument("--rows", type=int, default=1_000_000)
+    p.add_argument("--players", type=int, default=50_000)
+    p.add_argument("--chunk", type=int, default=20000)
+    p.set_defaults(func=bench_import)
+
+    p = sub.add_parser("replay", help="回放录制的画面，测各阶段耗时、吞吐与识别准确率（无界面）")
+    p.add_argument("recording", help="stzb.py --record 生成的目录")
+    p.add_argument("--backend", default="easyocr")
+    p.add_argument("--workers", type=int, default=0)
+    p.add_argument("--ocr-mode", default="fast", choices=["fast", "full"])
+    p.add_argument("--loop", type=int, default=1, help="重复回放次数")
+    p.add_argument("--seed-labels", action="store_true", help="为未标注的战报写入识别结果作为标注草稿")
+    p.set_defaults(func=bench_replay)
+
+    p = sub.add_parser("calibrate", help="在有标注的录制帧上为各区域挑选最省的预处理参数")
+    p.add_argument("recording", help="含 labels.json 的录制目录")
+    p.add_argument("--backend", default="easyocr")
+    p.add_argument("--ocr-mode", default="fast", choices=["fast", "full"])
+    p.add_argument("--rounds", type=int, default=3, help="每个候选重复识别的轮数，取耗时中位数")
+    p.add_argument("--top", type=int, default=8, help="每类区域列出最快的前几个候选")
+    p.add_argument("--write-config", action="store_true", help="把选中的参数写入 config.json")
+    p.set_defaults(func=bench_calibrate)
+
+    p = sub.add_parser("cache", help="阵容缓存：命中/未命中耗时与每条阵容的内存占用（无界面）")
+    p.add_argument("--db", help="用已有的库（默认生成合成数据）")
+    p.add_argument("--rows", type=int, default=200_000)
+    p.add_argument("--players", type=int, default=20_000)
+    p.add_argument("--sample", type=int, default=5000, help="查看的玩家数")
+    p.add_argument("--searches", type=int, default=200)
+    p.set_defaults(func=bench_cache)
+
+    p = sub.add_parser("query", help="查询服务（stzb.py --serve）压测：请求/秒与延迟分位数")
+    p.add_argument("--url", help="已在运行的服务地址，如 http://127.0.0.1:8765")
+    p.add_argument("--unix", help="已在运行的服务的 Unix 域套接字")
+    p.add_argument("--db", help="不给地址时用该库启动服务（默认生成合成数据）")
+    p.add_argument("--rows", type=int, default=200_000, help="合成数据的阵容记录数")
+    p.add_argument("--players", type=int, default=20_000)
+    p.add_argument("--pool", type=int, default=8, help="服务的只读连接数")
+    p.add_argument("--clients", type=int, default=16)
+    p.add_argument("--duration", type=float, default=10.0, help="压测秒数")
+    p.add_argument("--writes", type=float, default=0.0, help="压测期间每秒写入的战报数")
+    p.set_defaults(func=bench_query)
+
+    p = sub.add_parser("check", help="正确性自检：变化门、统计表、导出再导入等（无界面）")
+    p.add_argument("only", nargs="*", help=f"只跑指定的几项：{'、'.join(CHECKS)}（默认全部）")
+    p.set_defaults(func=run_checks)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,8 @@ pyinstaller --noconsole ^
     --onedir ^
     --name "鱨ܼ" ^
     --collect-all easyocr ^
+    --hidden-import PIL.ImageGrab ^
+    --hidden-import numpy ^
     --add-data "佫б.txt;." ^
     --clean ^
     stzb.py
@@ -37,6 +37,8 @@ def build():
         "--collect-all=easyocr",      # 抓取 easyocr 所有依赖
         "--collect-all=torch",        # 抓取 torch 所有依赖（含 CUDA dll）
         "--collect-submodules=cv2",   # 抓取 opencv 子模块
+        "--hidden-import=PIL.ImageGrab",  # 主程序延迟导入的模块，PyInstaller 静态分析看不到
+        "--hidden-import=numpy",
         "--clean",                    # 打包前清理缓存
         main_script
     ]
@@ -2,9 +2,9 @@ import os
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
 os.environ['OMP_NUM_THREADS'] = '1'
 
-import cv2
-import numpy as np
-import easyocr
+import sys
+import argparse
+import importlib
 import sqlite3
 import json
 import time
@@ -13,10 +13,39 @@ import difflib
 import re
 import hashlib
 import csv
+import queue
+import itertools
+import copy
+import bisect
+import heapq
+import logging
+import logging.handlers
+import multiprocessing
+from abc import ABC, abstractmethod
+from multiprocessing import shared_memory
+from collections import Counter, OrderedDict, defaultdict, deque, namedtuple
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
 from tkinter import *
-from tkinter import ttk, messagebox, filedialog
-from PIL import Image, ImageTk, ImageGrab
+from tkinter import ttk, messagebox, filedialog, simpledialog
+
+class _LazyModule:
+    """首次访问属性时才真正导入：cv2 / numpy / easyocr(torch) 不再拖慢窗口出现"""
+    def __init__(self, name):
+        self._name, self._mod = name, None
+
+    def __getattr__(self, attr):
+        if self._mod is None: self._mod = importlib.import_module(self._name)
+        return getattr(self._mod, attr)
+
+cv2 = _LazyModule("cv2")
+np = _LazyModule("numpy")
+easyocr = _LazyModule("easyocr")
+ImageGrab = _LazyModule("PIL.ImageGrab")
+http_server = _LazyModule("http.server")
 
 # ==================== 1. 配置与规则 ====================
 OCR_CORRECTIONS = {
@@ -26,8 +55,7 @@ OCR_CORRECTIONS = {
 }
 FACTION_MAP = {"吴": ["吴", "误", "口", "昊"], "汉": ["汉", "议", "汗"], "群": ["群", "郡", "君"], "魏": ["魏", "巍"], "蜀": ["蜀", "属"], "晋": ["晋", "肾"]}
 
-def load_general_pool():
-    file_path = "武将列表.txt"
+def load_general_pool(file_path="武将列表.txt"):
     default_pool = ["大乔", "张机", "孙权", "吕布", "吕蒙", "曹操", "刘备", "关羽", "马超", "卫瓘", "荀彧", "荀攸", "魏延", "妲己", "木鹿大王", "李儒", "夏侯惇", "夏侯霸"]
     if not os.path.exists(file_path):
         with open(file_path, "w", encoding="utf-8") as f: f.write("\n".join(default_pool))
@@ -36,146 +64,1039 @@ def load_general_pool():
         with open(file_path, "r", encoding="utf-8") as f: return [line.strip() for line in f.readlines() if line.strip()]
     except: return default_pool
 
-GENERAL_POOL = load_general_pool()
+class GeneralMatcher:
+    """武将名匹配器：启动时为武将库建字索引，只给共享（或易混）字的武将打分；
+    易混字按 CONFUSION_WEIGHT 计为部分匹配；同一 OCR 原文的结果走 LRU 缓存；武将列表文件变化后自动重建"""
+    CONFUSION_WEIGHT = 0.8
+
+    def __init__(self, file_path="武将列表.txt", cutoff=0.3, cache_size=4096, check_interval=2.0):
+        self.file_path, self.cutoff = file_path, cutoff
+        self.cache_size, self.check_interval = cache_size, check_interval
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._mtime, self._next_check = None, 0.0
+        # 易混字对：OCR 纠错表与阵营别字，双向
+        pairs = set(OCR_CORRECTIONS.items())
+        for f, aliases in FACTION_MAP.items(): pairs |= {(a, f) for a in aliases if a != f}
+        self.confusions = pairs | {(b, a) for a, b in pairs}
+        self._partners = defaultdict(set)
+        for a, b in self.confusions: self._partners[a].add(b)
+        self._maybe_reload(force=True)
+
+    def _build(self, pool):
+        self.pool = list(dict.fromkeys(pool))
+        self._index = defaultdict(set)
+        for i, name in enumerate(self.pool):
+            for ch in name: self._index[ch].add(i)
+        self._cache.clear()
+
+    def _file_mtime(self):
+        try: return os.path.getmtime(self.file_path)
+        except OSError: return None
+
+    def _maybe_reload(self, force=False):
+        now = time.monotonic()
+        if not force and now < self._next_check: return
+        self._next_check = now + self.check_interval
+        if not force and self._file_mtime() == self._mtime: return
+        pool = load_general_pool(self.file_path)  # 文件不存在时会写入默认武将库
+        with self._lock:
+            self._mtime = self._file_mtime()
+            self._build(pool)
+
+    def _score(self, q, cand):
+        matched = 0.0
+        for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, q, cand).get_opcodes():
+            if tag == "equal": matched += i2 - i1
+            elif tag == "replace":
+                matched += self.CONFUSION_WEIGHT * sum((a, b) in self.confusions for a, b in zip(q[i1:i2], cand[j1:j2]))
+        return 2 * matched / (len(q) + len(cand))
+
+    def best_match(self, name_part):
+        if not name_part: return None
+        chars = set(name_part)
+        for ch in list(chars): chars |= self._partners.get(ch, set())
+        cands = set().union(*(self._index.get(ch, ()) for ch in chars))
+        scored = [(self._score(name_part, self.pool[i]), self.pool[i]) for i in cands]
+        best = max(scored, default=None)
+        return best[1] if best and best[0] >= self.cutoff else None
+
+    def parse(self, raw_text):
+        """OCR 原文 -> "阵营 · 武将"（结果按原文缓存）"""
+        self._maybe_reload()
+        with self._lock:
+            if raw_text in self._cache:
+                self._cache.move_to_end(raw_text)
+                return self._cache[raw_text]
+        full_text = raw_text
+        for k, v in OCR_CORRECTIONS.items(): full_text = full_text.replace(k, v)
+        faction = "未知"
+        for f, aliases in FACTION_MAP.items():
+            for a in aliases:
+                if a in full_text: faction = f; full_text = full_text.replace(a, ""); break
+        name_part = re.sub(r'[^\u4e00-\u9fff]', '', full_text)
+        with self._lock:
+            match = self.best_match(name_part)
+            result = f"{faction} · {match or name_part or '未知'}"
+            self._cache[raw_text] = result
+            if len(self._cache) > self.cache_size: self._cache.popitem(last=False)
+        return result
+
+GENERAL_MATCHER = GeneralMatcher()
 
 # ==================== 2. 数据库管理 ====================
+def split_general(text):
+    """"吴 · 孙权" -> ("吴", "孙权")；没有阵营前缀时阵营为空"""
+    return tuple(text.split(" · ", 1)) if " · " in text else ("", text)
+
+def format_general(faction, name):
+    return f"{faction} · {name}" if faction else (name or "未知")
+
+def join_general(faction, name):
+    """split_general 的逆运算：按入库时的原文还原，空白格子仍为空。导出用，再导入时 team_hash 不变"""
+    return f"{faction} · {name}" if faction else (name or "")
+
+def team_hash_of(player_name, team_list):
+    names_only = [split_general(t)[1] for t in team_list]
+    return hashlib.md5(f"{player_name}{''.join(names_only)}".encode('utf-8')).hexdigest()
+
+def _schema_v1(c):
+    """初版表结构（含后来补加的 note 列）"""
+    c.execute("CREATE TABLE IF NOT EXISTS players (name TEXT PRIMARY KEY, last_seen TIMESTAMP)")
+    c.execute("CREATE TABLE IF NOT EXISTS teams (player_name TEXT, team_json TEXT, team_hash TEXT PRIMARY KEY, first_seen TIMESTAMP)")
+    c.execute("CREATE TABLE IF NOT EXISTS trust_list (name TEXT PRIMARY KEY)")
+    if "note" not in [r[1] for r in c.execute("PRAGMA table_info(teams)")]:
+        c.execute("ALTER TABLE teams ADD COLUMN note TEXT DEFAULT ''")
+
+def _schema_v2(c):
+    """阵容拆成结构化的 (槽位, 阵营, 武将) 行，并为玩家、时间、武将查询建立覆盖索引。
+    team_json 仍继续写入，旧版程序打开同一个库不受影响"""
+    c.execute("""CREATE TABLE team_members (team_hash TEXT NOT NULL, slot INTEGER NOT NULL, faction TEXT NOT NULL DEFAULT '',
+                 general TEXT NOT NULL, PRIMARY KEY (team_hash, slot)) WITHOUT ROWID""")
+    rows = []
+    for th, tj in c.execute("SELECT team_hash, team_json FROM teams").fetchall():
+        try: gens = json.loads(tj)
+        except: gens = []
+        gens = (list(gens) + ["未知 · 未知"] * 3)[:3]
+        rows += [(th, slot) + split_general(g) for slot, g in enumerate(gens)]
+    c.executemany("INSERT OR IGNORE INTO team_members VALUES (?, ?, ?, ?)", rows)
+    c.execute("CREATE INDEX idx_teams_player ON teams (player_name, first_seen DESC, team_hash, note)")
+    c.execute("CREATE INDEX idx_teams_first_seen ON teams (first_seen)")
+    c.execute("CREATE INDEX idx_players_last_seen ON players (last_seen)")
+    c.execute("CREATE INDEX idx_members_general ON team_members (general, faction, team_hash)")
+
+# 按槽位展开阵容的公共查询片段（大营/中军/前锋各一次主键查找）
+TEAM_MEMBERS_JOIN = """
+    LEFT JOIN team_members m0 ON m0.team_hash = t.team_hash AND m0.slot = 0
+    LEFT JOIN team_members m1 ON m1.team_hash = t.team_hash AND m1.slot = 1
+    LEFT JOIN team_members m2 ON m2.team_hash = t.team_hash AND m2.slot = 2"""
+TEAM_MEMBERS_COLS = "m0.faction, m0.general, m1.faction, m1.general, m2.faction, m2.general"
+
+def _members_to_team(cols, fmt=format_general):
+    return [fmt(cols[i], cols[i + 1]) for i in (0, 2, 4)]
+
+def generals_filter(generals, faction=None):
+    """阵容组合条件 -> (子查询, 参数)：子查询产出包含全部指定武将（不限槽位）的 team_hash；
+    faction 限定这些武将的阵营，只给阵营时为含该阵营武将的阵容。没有条件时返回 (None, [])"""
+    generals = list(dict.fromkeys(g for g in generals if g))
+    if generals:
+        sub = f"SELECT team_hash FROM team_members WHERE general IN ({','.join('?' * len(generals))})"
+        params = list(generals)
+        if faction: sub += " AND faction = ?"; params.append(faction)
+        sub += " GROUP BY team_hash HAVING COUNT(DISTINCT general) = ?"; params.append(len(generals))
+        return sub, params
+    if faction: return "SELECT DISTINCT team_hash FROM team_members WHERE faction = ?", [faction]
+    return None, []
+
+def _write_members(c, team_hash, team_list):
+    c.execute("DELETE FROM team_members WHERE team_hash = ?", (team_hash,))
+    c.executemany("INSERT INTO team_members VALUES (?, ?, ?, ?)",
+                  [(team_hash, slot) + split_general(g) for slot, g in enumerate(team_list[:3])])
+
+# --- 全文检索 ---
+# FTS5 默认分词会把连续汉字当成一个词，所以入库与查询都把文本拆成单字，
+# 查询用短语匹配，效果等同子串搜索且走倒排索引
+def fts_chars(text):
+    return " ".join("".join((text or "").split()))
+
+def fts_phrase(text):
+    chars = fts_chars(text)
+    return '"' + chars.replace('"', '""') + '"' if chars else None
+
+def _unindex_teams(c, hashes):
+    for i in range(0, len(hashes), 500):
+        part = hashes[i:i + 500]
+        marks = ",".join("?" * len(part))
+        c.execute(f"DELETE FROM search_fts WHERE rowid IN (SELECT fts_rowid FROM search_rows WHERE team_hash IN ({marks}))", part)
+        c.execute(f"DELETE FROM search_rows WHERE team_hash IN ({marks})", part)
+
+def _index_teams(c, hashes):
+    """按 teams + team_members 的当前内容重建这些阵容的检索行；任何改动阵容、备注或玩家名的写操作之后调用"""
+    hashes = list(dict.fromkeys(hashes))
+    _unindex_teams(c, hashes)
+    for i in range(0, len(hashes), 500):
+        part = hashes[i:i + 500]
+        rows = c.execute(f"SELECT t.team_hash, t.player_name, t.note, {TEAM_MEMBERS_COLS} FROM teams t {TEAM_MEMBERS_JOIN} "
+                         f"WHERE t.team_hash IN ({','.join('?' * len(part))})", part).fetchall()
+        last = c.execute("SELECT rowid FROM search_fts ORDER BY rowid DESC LIMIT 1").fetchone()
+        start = (last[0] if last else 0) + 1
+        c.executemany("INSERT INTO search_fts (rowid, player, generals, note, team_hash) VALUES (?, ?, ?, ?, ?)",
+                      [(start + k, fts_chars(r[1]), fts_chars("".join(x or "" for x in r[3:])), fts_chars(r[2]), r[0])
+                       for k, r in enumerate(rows)])
+        c.executemany("INSERT INTO search_rows VALUES (?, ?)", [(r[0], start + k) for k, r in enumerate(rows)])
+
+def _schema_v3(c):
+    """玩家名 / 武将 / 备注的 FTS5 全文索引；search_rows 记录每个阵容对应的检索行，供增量删除。
+    阵营单独建索引，配合 idx_members_general 构成武将/阵营 -> 阵容的倒排索引"""
+    c.execute("CREATE VIRTUAL TABLE search_fts USING fts5 (player, generals, note, team_hash UNINDEXED)")
+    c.execute("CREATE TABLE search_rows (team_hash TEXT PRIMARY KEY, fts_rowid INTEGER NOT NULL) WITHOUT ROWID")
+    c.execute("CREATE INDEX idx_members_faction ON team_members (faction, team_hash)")
+    _index_teams(c, [r[0] for r in c.execute("SELECT team_hash FROM teams").fetchall()])
+
+# --- 统计 ---
+# 四张聚合表随每次写入增量维护（与全文检索相同：改动前 _tally_teams(-1)，改动后 _tally_teams(+1)），
+# 统计界面只做主键/计数索引上的有限行查询，与记录总数无关。"未知" 与空白（CSV 里留空的格子）的武将与阵营不计入
+#   stats_generals: 武将(含阵营) 出现在多少个阵容中    stats_pairs: 两名武将同阵的阵容数（a < b）
+#   stats_player_factions: 玩家各阵营武将的人次          stats_daily: 每天新记录的阵容数
+STATS_TABLES = ("stats_generals", "stats_pairs", "stats_player_factions", "stats_daily")
+
+def _stats_schema(c, temp=""):
+    c.execute(f"""CREATE {temp} TABLE stats_generals (general TEXT NOT NULL, faction TEXT NOT NULL, count INTEGER NOT NULL,
+                 PRIMARY KEY (general, faction)) WITHOUT ROWID""")
+    c.execute(f"""CREATE {temp} TABLE stats_pairs (a TEXT NOT NULL, b TEXT NOT NULL, count INTEGER NOT NULL,
+                 PRIMARY KEY (a, b)) WITHOUT ROWID""")
+    c.execute(f"""CREATE {temp} TABLE stats_player_factions (player_name TEXT NOT NULL, faction TEXT NOT NULL, count INTEGER NOT NULL,
+                 PRIMARY KEY (player_name, faction)) WITHOUT ROWID""")
+    c.execute(f"CREATE {temp} TABLE stats_daily (day TEXT PRIMARY KEY, count INTEGER NOT NULL) WITHOUT ROWID")
+
+def _stats_fill(c, schema="main"):
+    """用 SQL 聚合从 teams + team_members 整体重算，写入 schema 下的空统计表；与增量维护互为校验"""
+    members = "team_members m JOIN teams t ON t.team_hash = m.team_hash"
+    c.execute(f"""INSERT INTO {schema}.stats_generals SELECT m.general, m.faction, COUNT(*) FROM {members}
+                  WHERE m.general NOT IN ('', '未知') GROUP BY m.general, m.faction""")
+    c.execute(f"""INSERT INTO {schema}.stats_pairs SELECT a.general, b.general, COUNT(DISTINCT a.team_hash)
+                  FROM team_members a JOIN team_members b ON b.team_hash = a.team_hash AND a.general < b.general
+                  JOIN teams t ON t.team_hash = a.team_hash
+                  WHERE a.general NOT IN ('', '未知') AND b.general NOT IN ('', '未知') GROUP BY a.general, b.general""")
+    c.execute(f"""INSERT INTO {schema}.stats_player_factions SELECT t.player_name, m.faction, COUNT(*) FROM {members}
+                  WHERE m.general NOT IN ('', '未知') AND m.faction NOT IN ('', '未知') GROUP BY t.player_name, m.faction""")
+    c.execute(f"INSERT INTO {schema}.stats_daily SELECT substr(first_seen, 1, 10), COUNT(*) FROM teams GROUP BY 1")
+
+def _tally_teams(c, hashes, sign):
+    """把这些阵容的当前内容计入（sign=1）或移出（sign=-1）统计表；不存在的哈希忽略"""
+    hashes = list(dict.fromkeys(hashes))
+    rows = []
+    for i in range(0, len(hashes), 500):
+        part = hashes[i:i + 500]
+        rows += c.execute(f"SELECT t.player_name, t.first_seen, {TEAM_MEMBERS_COLS} FROM teams t {TEAM_MEMBERS_JOIN} "
+                          f"WHERE t.team_hash IN ({','.join('?' * len(part))})", part).fetchall()
+    _tally_rows(c, rows, sign)
+
+def _tally_rows(c, rows, sign):
+    """rows: [(玩家, 记录时间, 阵营1, 武将1, 阵营2, 武将2, 阵营3, 武将3), ...]"""
+    generals, pairs, factions, daily = Counter(), Counter(), Counter(), Counter()
+    for r in rows:
+        daily[(r[1] or "")[:10]] += sign
+        names = set()
+        for faction, general in ((r[2], r[3]), (r[4], r[5]), (r[6], r[7])):
+            if general in (None, "", "未知"): continue
+            generals[(general, faction)] += sign
+            names.add(general)
+            if faction not in ("", "未知"): factions[(r[0], faction)] += sign
+        for a, b in itertools.combinations(sorted(names), 2): pairs[(a, b)] += sign
+    for table, keys, counts in (("stats_generals", ("general", "faction"), generals), ("stats_pairs", ("a", "b"), pairs),
+                                ("stats_player_factions", ("player_name", "faction"), factions), ("stats_daily", ("day",), daily)):
+        counts = sorted(k + (n,) if isinstance(k, tuple) else (k, n) for k, n in counts.items() if n)
+        if not counts: continue
+        cols = ", ".join(keys)
+        c.executemany(f"INSERT INTO {table} VALUES ({', '.join('?' * (len(keys) + 1))}) "
+                      f"ON CONFLICT ({cols}) DO UPDATE SET count = count + excluded.count", counts)
+        if sign < 0:
+            where = " AND ".join(f"{k} = ?" for k in keys)
+            c.executemany(f"DELETE FROM {table} WHERE {where} AND count <= 0", [r[:-1] for r in counts])
+
+def _schema_v4(c):
+    """增量维护的统计表，计数列建索引以便直接取前 N 名"""
+    _stats_schema(c)
+    c.execute("CREATE INDEX idx_stats_generals_count ON stats_generals (count DESC)")
+    c.execute("CREATE INDEX idx_stats_pairs_count ON stats_pairs (count DESC)")
+    _stats_fill(c)
+
+def _schema_v5(c):
+    """待确认的相似玩家名：识别出的新名先按原样入库（临时身份），记在这里，之后由用户批量改名/归并"""
+    c.execute("""CREATE TABLE review_queue (name TEXT PRIMARY KEY, similar_to TEXT NOT NULL, ratio REAL NOT NULL,
+                 first_seen TIMESTAMP NOT NULL, last_seen TIMESTAMP NOT NULL, sightings INTEGER NOT NULL DEFAULT 1) WITHOUT ROWID""")
+
+def _schema_v6(c):
+    """v4 的统计把空白武将也计入了，且之后的增量维护不再减去它们：整体重算一次"""
+    for table in STATS_TABLES: c.execute(f"DELETE FROM {table}")
+    _stats_fill(c)
+
+# 下标 + 1 即为迁移后的 PRAGMA user_version；只允许在末尾追加
+SCHEMA_MIGRATIONS = [_schema_v1, _schema_v2, _schema_v3, _schema_v4, _schema_v5, _schema_v6]
+
+class NameIndex:
+    """玩家名的字符倒排索引：只对共享字数足以达到阈值的候选计算 SequenceMatcher。
+    倒排键是 (字, 第几次出现)，命中次数即为两名字的字频交集，是匹配字数的上界"""
+    def __init__(self, names=()):
+        self._lock = threading.Lock()
+        self._postings = defaultdict(set)
+        self._names = set()
+        for n in names: self.add(n)
+
+    @staticmethod
+    def _keys(name):
+        seen = Counter()
+        for ch in name:
+            seen[ch] += 1
+            yield ch, seen[ch]
+
+    def add(self, name):
+        with self._lock:
+            if name in self._names: return
+            self._names.add(name)
+            for k in self._keys(name): self._postings[k].add(name)
+
+    def remove(self, name):
+        with self._lock:
+            if name not in self._names: return
+            self._names.discard(name)
+            for k in self._keys(name):
+                self._postings[k].discard(name)
+                if not self._postings[k]: del self._postings[k]
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def similar(self, name, cutoff=0.75):
+        """返回相似度 >= cutoff 的已知名字 [(ratio, name), ...]，按相似度从高到低"""
+        hits = Counter()
+        with self._lock:
+            for k in self._keys(name): hits.update(self._postings.get(k, ()))
+        n, out = len(name), []
+        for cand, shared in hits.items():
+            # ratio = 2M / (len_a + len_b)，M 不超过字频交集 shared
+            if 2 * shared < cutoff * (n + len(cand)): continue
+            ratio = difflib.SequenceMatcher(None, name, cand).ratio()
+            if ratio >= cutoff: out.append((ratio, cand))
+        return sorted(out, reverse=True)
+
+class RecentObservations:
+    """最近见过的 (玩家, 阵容哈希)：window 秒内重复出现的战报视为同一次观察。
+    按最近出现顺序排列的 OrderedDict，超过 max_size 时淘汰最久未见的；线程安全"""
+    def __init__(self, window=300.0, max_size=4096):
+        self.window, self.max_size = window, max_size
+        self._lock = threading.Lock()
+        self._seen = OrderedDict()
+        self.hits = 0
+
+    def check(self, key, now=None):
+        """窗口内见过返回 True（不刷新时间，保证窗口过后还会再写一次）；否则记下本次并返回 False"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            t = self._seen.get(key)
+            if t is not None and now - t < self.window:
+                self._seen.move_to_end(key)
+                self.hits += 1
+                return True
+            self._seen[key] = now
+            self._seen.move_to_end(key)
+            while len(self._seen) > self.max_size: self._seen.popitem(last=False)
+            return False
+
+    def discard(self, key):
+        """写入失败时撤销 check 记下的这一条，下次出现时重新写入"""
+        with self._lock: self._seen.pop(key, None)
+
+    def forget(self, player=None, team_hash=None):
+        """删除/改名后清掉相关记录，之后再出现时照常写入"""
+        with self._lock:
+            for key in [k for k in self._seen if k[0] == player or k[1] == team_hash]: del self._seen[key]
+
+# 一条阵容记录；namedtuple 即带 __slots__ = () 的 tuple 子类，没有实例 __dict__，解包用法与普通元组相同
+TeamRecord = namedtuple("TeamRecord", "time team_hash note team")
+
+class TeamCache:
+    """玩家阵容的读穿缓存：首次查看某玩家时从库中加载，之后直接从内存返回。
+    按最近使用排列，估算内存超过 max_bytes 时淘汰最久未看的玩家；武将名在整个缓存内共用同一个字符串对象。
+    写操作提交后按玩家精确作废；加载期间该玩家被作废时（token 失效）结果不入缓存，避免存入提交前的旧数据。
+    另有一个很小的检索结果缓存，任何作废都会清空它。线程安全"""
+    def __init__(self, loader, max_bytes=32 << 20, memo_size=64):
+        self.loader, self.max_bytes, self.memo_size = loader, max_bytes, memo_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # 玩家 -> (记录元组, 估算字节数)
+        self._loading = {}             # 玩家 -> 加载中的 token
+        self._strings = {}
+        self._memo = OrderedDict()
+        self.bytes = self.teams = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def _compact(self, rows):
+        """(记录时间, team_hash, 备注, [大营, 中军, 前锋]) -> TeamRecord，并返回估算字节数（不含共用的武将名）"""
+        intern = lambda v: self._strings.setdefault(v, v)
+        records = tuple(TeamRecord(tt, th, note or "", tuple(intern(g) for g in team)) for tt, th, note, team in rows)
+        size = sys.getsizeof(records) + sum(sys.getsizeof(r) + sys.getsizeof(r.time) + sys.getsizeof(r.team_hash)
+                                            + sys.getsizeof(r.note) + sys.getsizeof(r.team) for r in records)
+        return records, size
+
+    def get(self, name):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None:
+                self._entries.move_to_end(name)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            token = self._loading[name] = object()
+        rows = self.loader(name)
+        with self._lock:
+            records, size = self._compact(rows)
+            if self._loading.get(name) is token:
+                del self._loading[name]
+                self._entries[name] = (records, size)
+                self.bytes += size; self.teams += len(records)
+                while self.bytes > self.max_bytes and len(self._entries) > 1:
+                    _, (old, old_size) = self._entries.popitem(last=False)
+                    self.bytes -= old_size; self.teams -= len(old)
+                    self.evictions += 1
+            return records
+
+    def memo(self, key, compute):
+        """检索结果缓存：compute() 的结果按 key 保存到下一次作废"""
+        with self._lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                return self._memo[key]
+            token = self._loading[("memo",)] = object()
+        value = compute()
+        with self._lock:
+            if self._loading.get(("memo",)) is token:
+                self._memo[key] = value
+                if len(self._memo) > self.memo_size: self._memo.popitem(last=False)
+            return value
+
+    def invalidate(self, *names):
+        with self._lock:
+            for name in names:
+                entry = self._entries.pop(name, None)
+                if entry is not None: self.bytes -= entry[1]; self.teams -= len(entry[0])
+                self._loading.pop(name, None)
+            self._memo.clear(); self._loading.pop(("memo",), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear(); self._loading.clear(); self._memo.clear()
+            self.bytes = self.teams = 0
+
+    def stats(self):
+        with self._lock:
+            return {"players": len(self._entries), "teams": self.teams, "bytes": self.bytes,
+                    "bytes_per_team": round(self.bytes / self.teams) if self.teams else 0,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
 class DatabaseManager:
-    def __init__(self):
-        self.db_name = "rate_of_land.db"
+    """WAL 模式下：每个线程持有一条长期只读连接，所有写操作交给单独的写线程按批提交"""
+    def __init__(self, db_name="rate_of_land.db", batch_size=200, dedup_window=300.0, dedup_size=4096, cache_bytes=32 << 20):
+        self.db_name = db_name
+        self.batch_size = batch_size
+        # 各玩家的阵容记录在内存中的缓存：写操作提交后按玩家作废，其它进程（--ingest、导入工具）写库时整体作废
+        self.teams_cache = TeamCache(self._load_teams, cache_bytes)
+        # 同一张战报在 dedup_window 秒内重复出现时不再写库（也就不会刷新 last_seen 和列表）
+        self.recent = RecentObservations(dedup_window, dedup_size)
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self._submit_lock = threading.Lock()
+        self._closed = False
         self.init_db()
+        # 模糊匹配索引与白名单常驻内存，名字判定不再访问数据库
+        self.names = NameIndex(self.get_all_player_names())
+        self._trusted = set(self.get_trust_list())
+        # 待确认队列常驻内存（新名 -> 相似的已有名），监控线程判定名字时不访问数据库
+        self._review = dict(self._reader().execute("SELECT name, similar_to FROM review_queue").fetchall())
+        self._writer = threading.Thread(target=self._writer_loop, daemon=True)
+        self._writer.start()
 
     def init_db(self):
-        with sqlite3.connect(self.db_name) as conn:
-            c = conn.cursor()
-            c.execute("CREATE TABLE IF NOT EXISTS players (name TEXT PRIMARY KEY, last_seen TIMESTAMP)")
-            c.execute("CREATE TABLE IF NOT EXISTS teams (player_name TEXT, team_json TEXT, team_hash TEXT PRIMARY KEY, first_seen TIMESTAMP)")
-            c.execute("CREATE TABLE IF NOT EXISTS trust_list (name TEXT PRIMARY KEY)")
-            
-            try:
-                c.execute("SELECT note FROM teams LIMIT 1")
-            except sqlite3.OperationalError:
-                c.execute("ALTER TABLE teams ADD COLUMN note TEXT DEFAULT ''")
-            conn.commit()
-
+        conn = sqlite3.connect(self.db_name, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for v, migrate in enumerate(SCHEMA_MIGRATIONS[version:], start=version + 1):
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    migrate(conn.cursor())
+                    conn.execute(f"PRAGMA user_version = {v}")
+                    conn.execute("COMMIT")
+                except:
+                    conn.execute("ROLLBACK")
+                    raise
+        finally:
+            conn.close()
+
+    # --- 连接管理 ---
+    def _reader(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.db_name)
+        return conn
+
+    def _writer_loop(self):
+        conn = sqlite3.connect(self.db_name, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # 批量导入时各索引按哈希随机插入，页缓存放大到 64MB 避免反复换页
+        conn.execute("PRAGMA cache_size=-65536")
+        # 写连接上的 data_version 只随其它连接的提交变化；空闲时每秒看一次
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        running = True
+        try:
+            while running:
+                v = conn.execute("PRAGMA data_version").fetchone()[0]
+                if v != version: version = v; self.teams_cache.clear()
+                try: batch = [self._queue.get(timeout=1.0)]
+                except queue.Empty: continue
+                while len(batch) < self.batch_size:
+                    try: batch.append(self._queue.get_nowait())
+                    except queue.Empty: break
+                running = all(op is not None for op, _ in batch)
+                self._run_batch(conn, batch)
+        finally:
+            # 之后的 _submit 直接报错；已排队但没轮到的操作一并失败，调用方不会永远等待
+            with self._submit_lock:
+                self._closed = True
+                while True:
+                    try: op, fut = self._queue.get_nowait()
+                    except queue.Empty: break
+                    if op is None: fut.set_result(None)
+                    else: fut.set_exception(RuntimeError("数据库写线程已退出"))
+            conn.close()
+
+    def _run_batch(self, conn, batch):
+        """一批操作一个事务。加锁超时等导致整个事务失败时回滚，本批每个 Future 都收到该异常，写线程继续运行"""
+        done = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for op, fut in batch:
+                if op is None: done.append((fut, None, None)); continue
+                # 每个操作一个保存点，单个失败只回滚自己，不影响同批其它写入
+                conn.execute("SAVEPOINT op")
+                try:
+                    done.append((fut, op(conn.cursor()), None))
+                    conn.execute("RELEASE op")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO op"); conn.execute("RELEASE op")
+                    done.append((fut, None, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                try: conn.execute("ROLLBACK")
+                except sqlite3.Error: pass
+            METRICS.error("db_commit", e)
+            done = [(fut, None, None if op is None else e) for op, fut in batch]
+        for fut, result, err in done:
+            if err is not None: fut.set_exception(err)
+            else: fut.set_result(result)
+
+    def _submit(self, op, wait=True):
+        """op(cursor) 在写线程的事务中执行；wait=False 时返回 Future，提交后完成。写线程已退出时立即报错"""
+        fut = Future()
+        with self._submit_lock:
+            if self._closed: raise RuntimeError("数据库已关闭")
+            self._queue.put((op, fut))
+        return fut.result() if wait else fut
+
+    def flush(self):
+        self._submit(lambda c: None)
+
+    def close(self):
+        try: self._submit(None)
+        except RuntimeError: pass
+        self._writer.join()
+
+    # --- 读 ---
     def get_all_player_names(self):
-        with sqlite3.connect(self.db_name) as conn:
-            return [r[0] for r in conn.execute("SELECT name FROM players ORDER BY last_seen DESC").fetchall()]
+        return [r[0] for r in self._reader().execute("SELECT name FROM players ORDER BY last_seen DESC").fetchall()]
 
     def is_trusted(self, name):
-        with sqlite3.connect(self.db_name) as conn:
-            return conn.execute("SELECT 1 FROM trust_list WHERE name = ?", (name,)).fetchone() is not None
+        return name in self._trusted
+
+    def find_similar_players(self, name, cutoff=0.75):
+        return self.names.similar(name, cutoff)
 
+    def get_trust_list(self):
+        return [r[0] for r in self._reader().execute("SELECT name FROM trust_list").fetchall()]
+
+    def get_teams(self, player_name):
+        """返回 (TeamRecord(记录时间, team_hash, 备注, (大营, 中军, 前锋)), ...)，按时间倒序；走 teams_cache"""
+        return self.teams_cache.get(player_name)
+
+    def _load_teams(self, player_name):
+        sql = f"SELECT t.first_seen, t.team_hash, t.note, {TEAM_MEMBERS_COLS} FROM teams t {TEAM_MEMBERS_JOIN} WHERE t.player_name = ? ORDER BY t.first_seen DESC"
+        return [(r[0], r[1], r[2], _members_to_team(r[3:])) for r in self._reader().execute(sql, (player_name,))]
+
+    def search_players(self, text, limit=10000):
+        """全文检索玩家名、武将与备注（子串语义），返回命中的玩家名集合；同一关键字在下次写入前直接从内存返回"""
+        q = fts_phrase(text)
+        if not q: return set()
+        sql = "SELECT DISTINCT t.player_name FROM search_fts f JOIN teams t ON t.team_hash = f.team_hash WHERE search_fts MATCH ? LIMIT ?"
+        return self.teams_cache.memo(("search", q, limit), lambda: {r[0] for r in self._reader().execute(sql, (q, limit))})
+
+    def find_teams_by_generals(self, generals, faction=None, limit=1000):
+        """阵容组合查询：包含全部指定武将（不限槽位，可只给部分阵容）的阵容；
+        faction 限定这些武将的阵营，只给阵营时返回含该阵营武将的阵容。
+        返回 [(玩家, 记录时间, team_hash, 备注, [大营, 中军, 前锋]), ...]，按时间倒序"""
+        sub, params = generals_filter(generals, faction)
+        if sub is None: return []
+        sql = f"""SELECT t.player_name, t.first_seen, t.team_hash, t.note, {TEAM_MEMBERS_COLS}
+                  FROM ({sub}) h JOIN teams t ON t.team_hash = h.team_hash {TEAM_MEMBERS_JOIN}
+                  ORDER BY t.first_seen DESC LIMIT ?"""
+        return [r[:4] + (_members_to_team(r[4:]),) for r in self._reader().execute(sql, params + [limit])]
+
+    # --- 待确认的相似名 ---
+    @property
+    def review_count(self):
+        return len(self._review)
+
+    def get_review_queue(self):
+        """[(识别名, 相似的已有名, 相似度, 首次出现, 最近出现, 出现次数, 临时身份下的阵容数), ...]，按首次出现排序"""
+        return self._reader().execute("""SELECT q.name, q.similar_to, q.ratio, q.first_seen, q.last_seen, q.sightings,
+                                         (SELECT COUNT(*) FROM teams t WHERE t.player_name = q.name)
+                                         FROM review_queue q ORDER BY q.first_seen""").fetchall()
+
+    # --- 统计（只读聚合表，见 STATS_TABLES）---
+    def top_generals(self, limit=20):
+        """[(武将, 阵营, 阵容数), ...]"""
+        return self._reader().execute("SELECT general, faction, count FROM stats_generals ORDER BY count DESC LIMIT ?", (limit,)).fetchall()
+
+    def top_pairs(self, limit=20):
+        """[(武将A, 武将B, 同阵阵容数), ...]"""
+        return self._reader().execute("SELECT a, b, count FROM stats_pairs ORDER BY count DESC LIMIT ?", (limit,)).fetchall()
+
+    def player_factions(self, name):
+        """[(阵营, 武将人次), ...]，按人次倒序"""
+        return self._reader().execute("SELECT faction, count FROM stats_player_factions WHERE player_name = ? ORDER BY count DESC",
+                                      (name,)).fetchall()
+
+    def daily_counts(self, days=14):
+        """最近有记录的 days 天：[(日期, 新阵容数), ...]，按日期倒序"""
+        return self._reader().execute("SELECT day, count FROM stats_daily ORDER BY day DESC LIMIT ?", (days,)).fetchall()
+
+    def rebuild_stats(self):
+        """从 teams + team_members 整体重算统计表并替换。返回 {表名: 原表与重算结果的差异行数}，
+        计数不符的键两边各算一行；全为 0 说明增量维护无误"""
+        def op(c):
+            _stats_schema(c, "TEMP")
+            _stats_fill(c, "temp")
+            diff = {}
+            for table in STATS_TABLES:
+                missing, extra = (c.execute(f"SELECT COUNT(*) FROM (SELECT * FROM {x}.{table} EXCEPT SELECT * FROM {y}.{table})").fetchone()[0]
+                                  for x, y in (("temp", "main"), ("main", "temp")))
+                diff[table] = missing + extra
+                c.execute(f"DELETE FROM main.{table}")
+                c.execute(f"INSERT INTO main.{table} SELECT * FROM temp.{table}")
+                c.execute(f"DROP TABLE temp.{table}")
+            return diff
+        return self._submit(op)
+
+    # --- 写 ---
     def add_to_trust(self, name):
-        with sqlite3.connect(self.db_name) as conn:
-            conn.execute("INSERT OR IGNORE INTO trust_list VALUES (?)", (name,))
-            conn.commit()
+        self._trusted.add(name)
+        self._submit(lambda c: c.execute("INSERT OR IGNORE INTO trust_list VALUES (?)", (name,)))
 
     def remove_from_trust(self, name):
-        with sqlite3.connect(self.db_name) as conn:
-            conn.execute("DELETE FROM trust_list WHERE name = ?", (name,))
-            conn.commit()
-
-    def get_trust_list(self):
-        with sqlite3.connect(self.db_name) as conn:
-            return [r[0] for r in conn.execute("SELECT name FROM trust_list").fetchall()]
+        self._trusted.discard(name)
+        self._submit(lambda c: c.execute("DELETE FROM trust_list WHERE name = ?", (name,)))
 
     def rename_player(self, old_name, new_name):
-        with sqlite3.connect(self.db_name) as conn:
-            c = conn.cursor()
+        def op(c):
+            # 待确认队列：旧名本身不再存在，指向旧名的条目改指新名
+            c.execute("DELETE FROM review_queue WHERE name = ? OR (similar_to = ? AND name = ?)", (old_name, old_name, new_name))
+            c.execute("UPDATE review_queue SET similar_to = ? WHERE similar_to = ?", (new_name, old_name))
+            moved = [r[0] for r in c.execute("SELECT team_hash FROM teams WHERE player_name = ?", (old_name,))]
+            _tally_teams(c, moved, -1)
             c.execute("UPDATE OR IGNORE teams SET player_name = ? WHERE player_name = ?", (new_name, old_name))
             c.execute("DELETE FROM players WHERE name = ?", (old_name,))
             c.execute("INSERT OR REPLACE INTO players VALUES (?, ?)", (new_name, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-            conn.commit()
+            _index_teams(c, [r[0] for r in c.execute("SELECT team_hash FROM teams WHERE player_name = ?", (new_name,))])
+            _tally_teams(c, moved, 1)
+        self._submit(op)
+        self.teams_cache.invalidate(old_name, new_name)
+        self._review.pop(old_name, None)
+        if self._review.get(new_name) == old_name: del self._review[new_name]
+        for k, v in list(self._review.items()):
+            if v == old_name: self._review[k] = new_name
+        self.names.remove(old_name); self.names.add(new_name)
+        self.recent.forget(player=old_name)
 
     def delete_player(self, name):
-        with sqlite3.connect(self.db_name) as conn:
-            conn.execute("DELETE FROM players WHERE name = ?", (name,))
-            conn.execute("DELETE FROM teams WHERE player_name = ?", (name,))
-            conn.commit()
+        def op(c):
+            c.execute("DELETE FROM players WHERE name = ?", (name,))
+            c.execute("DELETE FROM review_queue WHERE name = ? OR similar_to = ?", (name, name))
+            hashes = [r[0] for r in c.execute("SELECT team_hash FROM teams WHERE player_name = ?", (name,))]
+            _unindex_teams(c, hashes)
+            _tally_teams(c, hashes, -1)
+            c.execute("DELETE FROM team_members WHERE team_hash IN (SELECT team_hash FROM teams WHERE player_name = ?)", (name,))
+            c.execute("DELETE FROM teams WHERE player_name = ?", (name,))
+        self._submit(op)
+        self.teams_cache.invalidate(name)
+        for k, v in list(self._review.items()):
+            if name in (k, v): del self._review[k]
+        self.names.remove(name)
+        self.recent.forget(player=name)
 
     def delete_team(self, team_hash):
-        with sqlite3.connect(self.db_name) as conn:
-            conn.execute("DELETE FROM teams WHERE team_hash = ?", (team_hash,))
-            conn.commit()
+        def op(c):
+            owner = c.execute("SELECT player_name FROM teams WHERE team_hash = ?", (team_hash,)).fetchone()
+            _unindex_teams(c, [team_hash])
+            _tally_teams(c, [team_hash], -1)
+            c.execute("DELETE FROM team_members WHERE team_hash = ?", (team_hash,))
+            c.execute("DELETE FROM teams WHERE team_hash = ?", (team_hash,))
+            return owner
+        owner = self._submit(op)
+        if owner: self.teams_cache.invalidate(owner[0])
+        self.recent.forget(team_hash=team_hash)
     
     def update_team(self, team_hash, new_team_list, new_note):
-        with sqlite3.connect(self.db_name) as conn:
-            conn.execute("UPDATE teams SET team_json = ?, note = ? WHERE team_hash = ?", 
-                         (json.dumps(new_team_list, ensure_ascii=False), new_note, team_hash))
-            conn.commit()
+        def op(c):
+            _tally_teams(c, [team_hash], -1)
+            c.execute("UPDATE teams SET team_json = ?, note = ? WHERE team_hash = ?", 
+                      (json.dumps(new_team_list, ensure_ascii=False), new_note, team_hash))
+            if c.rowcount: _write_members(c, team_hash, new_team_list); _index_teams(c, [team_hash]); _tally_teams(c, [team_hash], 1)
+            return c.execute("SELECT player_name FROM teams WHERE team_hash = ?", (team_hash,)).fetchone()
+        owner = self._submit(op)
+        if owner: self.teams_cache.invalidate(owner[0])
+
+    def queue_review(self, name, similar_to, ratio):
+        """异步记下一个待确认的相似名；已在队列中时只更新最近出现时间与次数"""
+        self._review.setdefault(name, similar_to)
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        return self._submit(lambda c: c.execute(
+            "INSERT INTO review_queue VALUES (?, ?, ?, ?, ?, 1) "
+            "ON CONFLICT (name) DO UPDATE SET last_seen = excluded.last_seen, sightings = sightings + 1",
+            (name, similar_to, ratio, now, now)), wait=False)
+
+    def resolve_review(self, name, action, trust=False):
+        """处理一条待确认项，返回 (被改掉的名字, 保留的名字)，"keep" 时为 None。action：
+        "merge" 识别有误，临时身份下的记录归入已有名；"rename" 玩家改了名，已有名的记录归入新名；
+        "keep" 是两个不同的玩家，新名加入白名单，以后不再提示。trust 时保留的名字加入白名单"""
+        old = self._review.get(name)
+        if old is None: return None
+        moved = {"merge": (name, old), "rename": (old, name)}.get(action)
+        if moved:
+            self.rename_player(*moved)
+            if trust: self.add_to_trust(moved[1])
+        else:
+            self.add_to_trust(name)
+        self._submit(lambda c: c.execute("DELETE FROM review_queue WHERE name = ?", (name,)))
+        self._review.pop(name, None)
+        return moved
 
     def save_record(self, player_name, team_list):
+        """异步写入，返回 Future；监控线程无需等待落盘。窗口期内重复的战报直接返回 None，不写库"""
         while len(team_list) < 3: team_list.append("未知 · 未知")
-        names_only = [t.split(" · ")[1] if " · " in t else t for t in team_list]
-        team_hash = hashlib.md5(f"{player_name}{''.join(names_only)}".encode('utf-8')).hexdigest()
+        team_hash = team_hash_of(player_name, team_list)
+        key = (player_name, team_hash)
+        if self.recent.check(key): return None
         now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        with sqlite3.connect(self.db_name) as conn:
-            c = conn.cursor()
+        team_json = json.dumps(team_list, ensure_ascii=False)
+        def op(c):
             c.execute("INSERT OR REPLACE INTO players VALUES (?, ?)", (player_name, now))
             c.execute("INSERT OR IGNORE INTO teams (player_name, team_json, team_hash, first_seen, note) VALUES (?, ?, ?, ?, ?)", 
-                      (player_name, json.dumps(team_list, ensure_ascii=False), team_hash, now, ""))
-            conn.commit()
-
-    def export_to_csv(self, filename):
-        with sqlite3.connect(self.db_name) as conn:
-            sql = """
-            SELECT t.player_name, t.first_seen, t.team_json, t.note, tr.name 
-            FROM teams t 
-            LEFT JOIN trust_list tr ON t.player_name = tr.name
-            ORDER BY t.first_seen DESC
-            """
-            rows = conn.execute(sql).fetchall()
+                      (player_name, team_json, team_hash, now, ""))
+            if c.rowcount: _write_members(c, team_hash, team_list); _index_teams(c, [team_hash]); _tally_teams(c, [team_hash], 1)
+        self.names.add(player_name)
+        try: fut = self._submit(op, wait=False)
+        except Exception: self.recent.discard(key); raise
+        def done(f):
+            if f.exception() is not None: self.recent.discard(key)
+            self.teams_cache.invalidate(player_name)
+        fut.add_done_callback(done)
+        return fut
+
+    def export_to_csv(self, filename, progress=None, cancel=None):
+        """逐行游标导出，内存占用与记录数无关；progress(已处理行数, 进度0~1)，cancel 为 threading.Event"""
+        sql = f"""
+        SELECT t.player_name, t.first_seen, t.note, tr.name, {TEAM_MEMBERS_COLS}
+        FROM teams t {TEAM_MEMBERS_JOIN}
+        LEFT JOIN trust_list tr ON t.player_name = tr.name
+        ORDER BY t.first_seen DESC
+        """
+        conn = self._reader()
+        total = conn.execute("SELECT COUNT(*) FROM teams").fetchone()[0] or 1
+        count = 0
         try:
             with open(filename, 'w', newline='', encoding='utf-8-sig') as csvfile:
                 writer = csv.writer(csvfile)
                 writer.writerow(['玩家名称', '是否白名单', '记录时间', '大营', '中军', '前锋', '备注'])
-                for row in rows:
-                    p_name, f_seen, t_json, note, trusted_name = row
+                for row in conn.execute(sql):
+                    p_name, f_seen, note, trusted_name = row[:4]
                     is_trusted = "是" if trusted_name else "否"
-                    try:
-                        gens = json.loads(t_json)
-                        while len(gens) < 3: gens.append("未知")
-                    except:
-                        gens = ["未知", "未知", "未知"]
+                    gens = _members_to_team(row[4:], join_general)
                     writer.writerow([p_name, is_trusted, f_seen, gens[0], gens[1], gens[2], note])
-            return True, f"成功导出 {len(rows)} 条记录"
+                    count += 1
+                    if count % 5000 == 0:
+                        if cancel and cancel.is_set(): return False, f"已取消，已写出 {count} 条记录"
+                        if progress: progress(count, count / total)
+            if progress: progress(count, 1.0)
+            return True, f"成功导出 {count} 条记录"
         except Exception as e:
             return False, str(e)
 
-    def import_from_csv(self, filename):
+    @staticmethod
+    def _import_chunk(c, rows):
+        """一批 CSV 行：每张表一次 executemany，检索索引按批重建。
+        已在库中的阵容只会更新备注，统计只需计入新阵容"""
+        c.executemany("INSERT OR IGNORE INTO trust_list VALUES (?)", [(r[0],) for r in rows if r[1]])
+        # 同一玩家在块内多次出现时只写最后一次，与逐行 REPLACE 结果相同
+        c.executemany("INSERT OR REPLACE INTO players VALUES (?, ?)", list({r[0]: r[2] for r in rows}.items()))
+        # 以哈希为键的表按哈希顺序插入，B 树写入集中在相邻页；稳定排序保证同一阵容仍是后出现的备注生效
+        rows = sorted(rows, key=lambda r: r[5])
+        hashes = list(dict.fromkeys(r[5] for r in rows))
+        existing = set()
+        for i in range(0, len(hashes), 500):
+            part = hashes[i:i + 500]
+            existing.update(r[0] for r in c.execute(f"SELECT team_hash FROM teams WHERE team_hash IN ({','.join('?' * len(part))})", part))
+        c.executemany("""
+            INSERT INTO teams (player_name, team_json, team_hash, first_seen, note) 
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(team_hash) DO UPDATE SET note = excluded.note
+        """, [(r[0], json.dumps(r[3], ensure_ascii=False), r[5], r[2], r[4]) for r in rows])
+        c.executemany("INSERT OR IGNORE INTO team_members VALUES (?, ?, ?, ?)",
+                      [(r[5], slot) + split_general(g) for r in rows for slot, g in enumerate(r[3])])
+        _index_teams(c, hashes)
+        # 新阵容的玩家、时间与武将取块内首次出现的那一行（后出现的只更新备注），直接由 CSV 行计入统计
+        first = {}
+        for r in rows:
+            if r[5] not in existing and r[5] not in first:
+                first[r[5]] = (r[0], r[2]) + tuple(x for g in (list(r[3]) + [None] * 3)[:3] for x in (split_general(g) if g else (None, None)))
+        _tally_rows(c, first.values(), 1)
+
+    def import_from_csv(self, filename, progress=None, cancel=None, chunk_size=20000):
+        """流式导入：按块解析并交给写线程批量提交，每块一个事务；取消时已提交的块保留。
+        块越大 WAL 检查点越少，2 万行时每次提交约一两秒，取消仍能及时响应。
+        progress(已导入行数, 进度0~1)，cancel 为 threading.Event"""
         count = 0
         try:
-            with open(filename, 'r', encoding='utf-8-sig') as csvfile:
+            total = os.path.getsize(filename) or 1
+            with open(filename, 'r', encoding='utf-8-sig', newline='') as csvfile:
                 reader = csv.reader(csvfile)
                 header = next(reader, None)
                 if not header: return False, "空文件"
-                with sqlite3.connect(self.db_name) as conn:
-                    c = conn.cursor()
-                    for row in reader:
-                        if len(row) < 7: continue
-                        p_name = row[0].strip()
-                        is_trusted = row[1].strip()
-                        f_seen = row[2].strip()
-                        gens = [row[3].strip(), row[4].strip(), row[5].strip()]
-                        note = row[6].strip()
-                        if not p_name: continue
-                        if is_trusted == "是":
-                            c.execute("INSERT OR IGNORE INTO trust_list VALUES (?)", (p_name,))
-                        c.execute("INSERT OR REPLACE INTO players VALUES (?, ?)", (p_name, f_seen))
-                        names_only = [t.split(" · ")[1] if " · " in t else t for t in gens]
-                        team_hash = hashlib.md5(f"{p_name}{''.join(names_only)}".encode('utf-8')).hexdigest()
-                        team_json = json.dumps(gens, ensure_ascii=False)
-                        c.execute("""
-                            INSERT INTO teams (player_name, team_json, team_hash, first_seen, note) 
-                            VALUES (?, ?, ?, ?, ?)
-                            ON CONFLICT(team_hash) DO UPDATE SET note = excluded.note
-                        """, (p_name, team_json, team_hash, f_seen, note))
-                        count += 1
-                    conn.commit()
+                chunk, pending = [], None
+                def flush(chunk):
+                    fut = self._submit(lambda c: self._import_chunk(c, chunk), wait=False)
+                    players = {r[0] for r in chunk}
+                    def done(f):
+                        self.teams_cache.invalidate(*players)
+                        # 整块回滚时库里没有这些名字，内存索引和白名单也不加
+                        if f.exception() is not None: return
+                        for r in chunk:
+                            self.names.add(r[0])
+                            if r[1]: self._trusted.add(r[0])
+                    fut.add_done_callback(done)
+                    return fut
+                for row in reader:
+                    if len(row) < 7: continue
+                    p_name = row[0].strip()
+                    if not p_name: continue
+                    gens = [row[3].strip(), row[4].strip(), row[5].strip()]
+                    chunk.append((p_name, row[1].strip() == "是", row[2].strip(), gens, row[6].strip(), team_hash_of(p_name, gens)))
+                    if len(chunk) >= chunk_size:
+                        # 解析下一块的同时写线程提交上一块；最多一块在途，内存占用恒定
+                        if pending: pending.result()
+                        pending, chunk = flush(chunk), []
+                        count += chunk_size
+                        if progress: progress(count, csvfile.buffer.tell() / total)
+                        if cancel and cancel.is_set():
+                            pending.result()
+                            return False, f"已取消，已导入 {count} 条记录"
+                if chunk:
+                    if pending: pending.result()
+                    pending = flush(chunk)
+                    count += len(chunk)
+                if pending: pending.result()
+            if progress: progress(count, 1.0)
             return True, f"成功导入 {count} 条记录"
         except Exception as e:
             return False, f"导入失败: {e}"
 
+# --- 只读查询服务 ---
+def readonly_uri(db_name):
+    return Path(os.path.abspath(db_name)).as_uri() + "?mode=ro"
+
+class ReadPool:
+    """固定数量的只读连接（mode=ro），借出时独占；并发请求数超过连接数时排队等待"""
+    def __init__(self, db_name, size=8):
+        uri = readonly_uri(db_name)
+        self._free = queue.Queue()
+        for _ in range(size):
+            self._free.put(sqlite3.connect(uri, uri=True, check_same_thread=False))
+
+    @contextmanager
+    def connection(self):
+        conn = self._free.get()
+        try: yield conn
+        finally: self._free.put(conn)
+
+class QueryCache:
+    """热点查询结果的 LRU 缓存。数据库有新提交时（PRAGMA data_version 变化）整体作废。
+    generation 在作废时加一：查询开始前取 generation，存入时若已变化说明结果可能过期，丢弃不存"""
+    # 未命中时 get 返回的哨兵；None 是合法的缓存结果（如查无此玩家）
+    MISS = object()
+
+    def __init__(self, db_name, max_entries=2048):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = self.misses = 0
+        # data_version 只在同一连接的前后两次读取之间可比，所以专用一条连接
+        uri = readonly_uri(db_name)
+        self._watch = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self._version = self._watch.execute("PRAGMA data_version").fetchone()[0]
+
+    def validate(self):
+        """检查是否有新的写入，返回当前 generation"""
+        with self._lock:
+            version = self._watch.execute("PRAGMA data_version").fetchone()[0]
+            if version != self._version:
+                self._version = version
+                self._entries.clear()
+                self.generation += 1
+            return self.generation
+
+    def get(self, key):
+        """未命中返回 QueryCache.MISS"""
+        with self._lock:
+            value = self._entries.get(key, self.MISS)
+            if value is self.MISS: self.misses += 1; return value
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, generation):
+        with self._lock:
+            if generation != self.generation: return
+            self._entries[key] = value
+            if len(self._entries) > self.max_entries: self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses, "generation": self.generation}
+
+class QueryService:
+    """情报库的只读查询，供本机的联盟工具调用（见 serve_main）。
+    列表结果按记录时间倒序分页：每页带 next 游标，原样传回即取下一页，翻页期间有新记录也不会错位重复"""
+    MAX_LIMIT = 500
+
+    def __init__(self, db_name, pool_size=8, cache_size=2048):
+        self.db_name = db_name
+        self.pool = ReadPool(db_name, pool_size)
+        self.cache = QueryCache(db_name, cache_size)
+
+    def query(self, route, params):
+        """route 为 "teams" / "players" / "player"，params 为 {参数名: [值, ...]}；返回可 JSON 序列化的结果"""
+        handler = {"teams": self.teams, "players": self.players, "player": self.player}.get(route)
+        if handler is None: raise KeyError(route)
+        key = (route, tuple(sorted((k, tuple(v)) for k, v in params.items())))
+        generation = self.cache.validate()
+        result = self.cache.get(key)
+        if result is QueryCache.MISS:
+            with self.pool.connection() as conn:
+                result = handler(conn, params)
+            self.cache.put(key, result, generation)
+        return result
+
+    @staticmethod
+    def _one(params, name, default=None):
+        return params.get(name, [default])[0]
+
+    @classmethod
+    def _limit(cls, params, default=50):
+        try: limit = int(cls._one(params, "limit", default))
+        except ValueError: raise ValueError("limit 须为整数")
+        return max(1, min(limit, cls.MAX_LIMIT))
+
+    TIME_PREFIX = re.compile(r"\d{4}(-\d{2}(-\d{2}([ T]\d{2}(:\d{2}(:\d{2})?)?)?)?)?")
+
+    @classmethod
+    def _time_bound(cls, params, name):
+        """since / until 补齐为完整的 YYYY-MM-DD HH:MM:SS。first_seen 列声明为 TIMESTAMP（NUMERIC 亲和），
+        只写年份的 "2026" 会被当成整数与文本比较，补齐后按文本比较，与前缀的含义一致"""
+        value = cls._one(params, name)
+        if not value: return None
+        value = value.strip().replace("T", " ")
+        if not cls.TIME_PREFIX.fullmatch(value): raise ValueError(f"{name} 须为时间或其前缀，如 2025、2025-12、2025-12-01 08:00")
+        value += "0000-01-01 00:00:00"[len(value):]
+        try: datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+        except ValueError: raise ValueError(f"无效的 {name}: {value}")
+        return value
+
+    @staticmethod
+    def _page(rows, limit, cursor_of):
+        """多取的一行用来判断是否还有下一页"""
+        more = len(rows) > limit
+        rows = rows[:limit]
+        return rows, (cursor_of(rows[-1]) if more else None)
+
+    @staticmethod
+    def _cursor(params):
+        cursor = QueryService._one(params, "cursor")
+        if not cursor: return None
+        try:
+            key, tie = cursor.split("|", 1)
+            return key, tie
+        except ValueError: raise ValueError("无效的 cursor")
+
+    def teams(self, conn, params):
+        """阵容记录。可任意组合：player 玩家名；general 武将（可多个，须同时在阵中）；faction 武将阵营；
+        since / until 记录时间范围（含 since 不含 until，可只写前缀如 2026、2025-12，格式不对时报 400）"""
+        limit = self._limit(params)
+        sub, args = generals_filter(params.get("general", []), self._one(params, "faction"))
+        sql = f"SELECT t.rowid, t.player_name, t.first_seen, t.team_hash, t.note, {TEAM_MEMBERS_COLS} FROM teams t"
+        if sub: sql += f" JOIN ({sub}) h ON h.team_hash = t.team_hash"
+        sql += TEAM_MEMBERS_JOIN
+        where = []
+        player = self._one(params, "player")
+        if player: where.append("t.player_name = ?"); args.append(player)
+        for name, cond in (("since", "t.first_seen >= ?"), ("until", "t.first_seen < ?")):
+            value = self._time_bound(params, name)
+            if value: where.append(cond); args.append(value)
+        cursor = self._cursor(params)
+        if cursor:
+            where.append("(t.first_seen, t.rowid) < (?, ?)"); args += [cursor[0], int(cursor[1])]
+        if where: sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY t.first_seen DESC, t.rowid DESC LIMIT ?"
+        rows, nxt = self._page(conn.execute(sql, args + [limit + 1]).fetchall(), limit, lambda r: f"{r[2]}|{r[0]}")
+        items = [{"player": r[1], "time": r[2], "team_hash": r[3], "note": r[4], "team": _members_to_team(r[5:])} for r in rows]
+        return {"items": items, "next": nxt}
+
+    def players(self, conn, params):
+        """玩家列表，按最后出现时间倒序；q 为全文检索（玩家名、武将、备注的子串）"""
+        limit = self._limit(params)
+        sql, args, where = "SELECT p.name, p.last_seen FROM players p", [], []
+        q = fts_phrase(self._one(params, "q", ""))
+        if q:
+            where.append("p.name IN (SELECT t.player_name FROM search_fts f JOIN teams t ON t.team_hash = f.team_hash "
+                         "WHERE search_fts MATCH ?)")
+            args.append(q)
+        cursor = self._cursor(params)
+        if cursor:
+            where.append("(p.last_seen, p.name) < (?, ?)"); args += list(cursor)
+        if where: sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY p.last_seen DESC, p.name DESC LIMIT ?"
+        rows, nxt = self._page(conn.execute(sql, args + [limit + 1]).fetchall(), limit, lambda r: f"{r[1]}|{r[0]}")
+        return {"items": [{"name": r[0], "last_seen": r[1]} for r in rows], "next": nxt}
+
+    def player(self, conn, params):
+        """单个玩家的概况：最后出现时间、是否白名单、阵容数；阵容本身用 teams?player= 分页获取"""
+        name = self._one(params, "name")
+        if not name: raise ValueError("缺少 name")
+        row = conn.execute("SELECT last_seen FROM players WHERE name = ?", (name,)).fetchone()
+        if row is None: return None
+        return {"name": name, "last_seen": row[0],
+                "trusted": conn.execute("SELECT 1 FROM trust_list WHERE name = ?", (name,)).fetchone() is not None,
+                "teams": conn.execute("SELECT COUNT(*) FROM teams WHERE player_name = ?", (name,)).fetchone()[0]}
+
 # ==================== 3. 弹窗 UI ====================
 
 class AboutDialog(Toplevel):
@@ -203,6 +1124,7 @@ class AboutDialog(Toplevel):
             ● 建议在游戏窗口化模式下使用，效果最佳。
             ● 识别武将时，请先拉取一个能覆盖三名武将的长方形区域。
             ● 若遇到生僻字无法识别，可在‘武将列表.txt’中手动添加。
+            ● 与已有玩家高度相似的新名会先照常录入，之后点‘🔔 待确认’批量归并或改名。
 
             【开发者信息】
             开发者：天丨暗星
@@ -228,30 +1150,55 @@ class AboutDialog(Toplevel):
         self.transient(parent)
         self.grab_set()
 
-class SimilarityDialog(Toplevel):
-    def __init__(self, parent, new_name, old_name):
+class ReviewQueueDialog(Toplevel):
+    """待确认的相似玩家名：监控时遇到与已有玩家高度相似的新名，先按识别结果入库并记在队列里，在这里批量处理。
+    可多选（Ctrl/Shift），对选中项统一执行同一种处理"""
+    ACTIONS = (("merge", "归入已有名（识别有误）"), ("rename", "改用新名（玩家改名）"), ("keep", "不同玩家（都保留）"))
+
+    def __init__(self, parent, db, on_resolved):
+        """on_resolved(moved) 在主线程中对每个处理完的项调用一次，moved 为 resolve_review 的返回值"""
         super().__init__(parent)
-        self.title("重名检查")
-        self.geometry("450x250")
-        self.configure(bg="#fdfcfb")
-        self.result = None
+        self.title("待确认的相似玩家名")
+        self.geometry("820x480")
+        self.db, self.on_resolved = db, on_resolved
+        cols = ("name", "similar_to", "ratio", "sightings", "teams", "first_seen", "last_seen")
+        heads = ("识别名", "已有玩家", "相似度", "出现次数", "临时身份阵容", "首次出现", "最近出现")
+        self.tree = ttk.Treeview(self, columns=cols, show="headings", selectmode=EXTENDED)
+        for c, h in zip(cols, heads):
+            self.tree.heading(c, text=h)
+            self.tree.column(c, width=140 if c in ("name", "similar_to", "first_seen", "last_seen") else 80, anchor=CENTER)
+        self.tree.pack(fill=BOTH, expand=True, padx=10, pady=10)
+        btn_f = Frame(self)
+        btn_f.pack(pady=5)
+        ttk.Button(btn_f, text="全选", command=lambda: self.tree.selection_set(self.tree.get_children())).pack(side=LEFT, padx=5)
+        self.buttons = [ttk.Button(btn_f, text=text, command=lambda a=action: self.apply(a)) for action, text in self.ACTIONS]
+        for b in self.buttons: b.pack(side=LEFT, padx=5)
         self.trust_var = BooleanVar(value=False)
-        
-        Label(self, text="⚠️ 发现高度相似玩家名", font=("微软雅黑", 12, "bold"), fg="#e67e22", bg="#fdfcfb").pack(pady=15)
-        Label(self, text=f"识别结果: {new_name}", font=("微软雅黑", 10), bg="#fdfcfb").pack()
-        Label(self, text=f"数据库已有: {old_name}", font=("微软雅黑", 10, "bold"), fg="#2980b9", bg="#fdfcfb").pack(pady=5)
-        
-        btn_f = Frame(self, bg="#fdfcfb")
-        btn_f.pack(pady=20)
-        ttk.Button(btn_f, text=f"使用新名", command=lambda: self.done("use_new"), width=15).pack(side=LEFT, padx=10)
-        ttk.Button(btn_f, text=f"保留旧名", command=lambda: self.done("keep_old"), width=15).pack(side=LEFT, padx=10)
-        
-        Checkbutton(self, text="记住选择，不再询问", variable=self.trust_var, bg="#fdfcfb", font=("微软雅黑", 9)).pack()
-        self.grab_set()
+        Checkbutton(self, text="记住选择：保留的名字加入白名单，以后直接判定", variable=self.trust_var).pack()
+        self.status = Label(self, text="", fg="#7f8c8d")
+        self.status.pack(pady=(0, 8))
+        self.refresh()
 
-    def done(self, action):
-        self.result = (action, self.trust_var.get())
-        self.destroy()
+    def refresh(self):
+        self.tree.delete(*self.tree.get_children())
+        for name, similar_to, ratio, first, last, sightings, teams in self.db.get_review_queue():
+            self.tree.insert("", END, iid=name, values=(name, similar_to, f"{ratio:.0%}", sightings, teams, first, last))
+        self.status.config(text=f"共 {len(self.tree.get_children())} 项")
+
+    def apply(self, action):
+        names = list(self.tree.selection())
+        if not names: return
+        for b in self.buttons: b.config(state=DISABLED)
+        trust = self.trust_var.get()
+        def work():
+            for name in names:
+                self.after(0, self.on_resolved, self.db.resolve_review(name, action, trust))
+            self.after(0, done)
+        def done():
+            if not self.winfo_exists(): return
+            for b in self.buttons: b.config(state=NORMAL)
+            self.refresh()
+        threading.Thread(target=work, daemon=True).start()
 
 class TrustManager(Toplevel):
     def __init__(self, parent, db, callback):
@@ -323,72 +1270,1288 @@ class EditTeamDialog(Toplevel):
         self.callback()
         self.destroy()
 
-# ==================== 4. 识别引擎 ====================
+class ProgressDialog(Toplevel):
+    """后台任务的进度窗口，关闭或点取消只发出取消信号，由任务自行收尾"""
+    def __init__(self, parent, title):
+        super().__init__(parent)
+        self.title(title)
+        self.geometry("380x160")
+        self.resizable(False, False)
+        self.configure(bg="#ecf0f1")
+        self.cancel_event = threading.Event()
+
+        self.msg = Label(self, text="准备中...", font=("微软雅黑", 10), bg="#ecf0f1")
+        self.msg.pack(pady=15)
+        self.bar = ttk.Progressbar(self, length=320, maximum=1.0)
+        self.bar.pack()
+        ttk.Button(self, text="取消", command=self.cancel).pack(pady=15)
+        self.protocol("WM_DELETE_WINDOW", self.cancel)
+        self.transient(parent)
+
+    def cancel(self):
+        self.cancel_event.set()
+        self.msg.config(text="正在取消...")
+
+    def update_progress(self, count, frac):
+        if self.cancel_event.is_set(): return
+        self.msg.config(text=f"已处理 {count} 条（{frac:.0%}）")
+        self.bar["value"] = frac
+
+class DiagnosticsDialog(Toplevel):
+    """诊断面板：每秒刷新各阶段耗时分位数、耗时分布、错误数，以及调度器的各状态统计"""
+    STAGE_NAMES = {"tick": "整个周期", "capture": "截屏", "block_gate": "遮挡检测", "icon_gate": "战报图标检测",
+                   "recognize": "识别（合计）", "report_cached": "战报未变化", "preprocess": "图像预处理", "ocr": "OCR",
+                   "match": "武将/玩家名解析", "name": "玩家名判定", "save": "提交写入", "db_commit": "写入完成",
+                   "ui_refresh": "列表刷新", "dedup": "重复战报（跳过）", "decode": "截图解码", "icon_template": "图标模板", "ocr_worker": "识别进程",
+                   "player_select": "查看玩家", "record": "录制"}
+    BARS = " ▁▂▃▄▅▆▇█"
+
+    def __init__(self, parent, metrics, schedulers, cache=None):
+        """schedulers() 返回 {采集方案名: MonitorScheduler}；cache 为 TeamCache"""
+        super().__init__(parent)
+        self.title("性能诊断")
+        self.geometry("900x660")
+        self.metrics, self.schedulers, self.cache = metrics, schedulers, cache
+        self._after_id = None
+
+        Label(self, text="各阶段耗时（毫秒，最近 %d 次）" % metrics.window, font=("微软雅黑", 10, "bold")).pack(anchor=W, padx=10, pady=(10, 0))
+        cols = ("stage", "count", "p50", "p90", "p99", "max", "hist", "errors", "last_error")
+        heads = ("阶段", "次数", "p50", "p90", "p99", "最大", "分布 1ms→1s+", "错误", "最近错误")
+        widths = (120, 60, 60, 60, 60, 60, 110, 50, 260)
+        self.stage_tree = ttk.Treeview(self, columns=cols, show="headings", height=12)
+        for c, h, w in zip(cols, heads, widths):
+            self.stage_tree.heading(c, text=h)
+            self.stage_tree.column(c, width=w, anchor=W if c in ("stage", "hist", "last_error") else CENTER)
+        self.stage_tree.pack(fill=BOTH, expand=True, padx=10, pady=5)
+
+        Label(self, text="调度器", font=("微软雅黑", 10, "bold")).pack(anchor=W, padx=10)
+        cols = ("profile", "state", "ticks", "avg_work_ms", "max_work_ms", "avg_sleep_ms", "overruns")
+        heads = ("方案", "状态", "周期数", "平均处理", "最大处理", "平均休眠", "超预算")
+        self.sched_tree = ttk.Treeview(self, columns=cols, show="headings", height=8)
+        for c, h in zip(cols, heads):
+            self.sched_tree.heading(c, text=h)
+            self.sched_tree.column(c, width=100, anchor=CENTER)
+        self.sched_tree.pack(fill=X, padx=10, pady=5)
+        self.cache_label = Label(self, text="", anchor=W)
+        self.cache_label.pack(fill=X, padx=10)
+        ttk.Button(self, text="清零", command=self.metrics.reset).pack(pady=5)
+        self.refresh()
+
+    def _bars(self, hist):
+        top = max(hist) or 1
+        return "".join(self.BARS[(n * (len(self.BARS) - 1) + top - 1) // top] for n in hist)
+
+    def refresh(self):
+        if not self.winfo_exists(): return
+        fmt = lambda v: "-" if v is None else v
+        self.stage_tree.delete(*self.stage_tree.get_children())
+        for stage, st in self.metrics.snapshot().items():
+            self.stage_tree.insert("", END, values=(self.STAGE_NAMES.get(stage, stage), st["count"], fmt(st["p50"]), fmt(st["p90"]),
+                                                    fmt(st["p99"]), fmt(st["max"]), self._bars(st["hist"]), st["errors"],
+                                                    st["last_error"] or ""))
+        self.sched_tree.delete(*self.sched_tree.get_children())
+        for name, scheduler in self.schedulers().items():
+            for state, st in scheduler.stats().items():
+                self.sched_tree.insert("", END, values=(name, state, st["ticks"], st["avg_work_ms"], st["max_work_ms"],
+                                                        st["avg_sleep_ms"], st["overruns"]))
+        if self.cache is not None:
+            st = self.cache.stats()
+            self.cache_label.config(text=f"阵容缓存：{st['players']} 名玩家 / {st['teams']} 条阵容，约 {st['bytes'] / (1 << 20):.1f}MB"
+                                         f"（{st['bytes_per_team']} 字节/条）｜命中 {st['hits']}，未命中 {st['misses']}，淘汰 {st['evictions']}")
+        self._after_id = self.after(1000, self.refresh)
+
+    def destroy(self):
+        # 关闭窗口后取消已排队的刷新，否则回调会作用在已销毁的控件上
+        if self._after_id is not None: self.after_cancel(self._after_id); self._after_id = None
+        super().destroy()
+
+class StatsDialog(Toplevel):
+    """阵容统计：读增量维护的统计表，打开与刷新都只取前 N 行，与库的大小无关"""
+    def __init__(self, parent, db, selected_player):
+        """selected_player() 返回主界面当前选中的玩家名（可为 None）"""
+        super().__init__(parent)
+        self.title("阵容统计")
+        self.geometry("900x620")
+        self.db, self.selected_player = db, selected_player
+        grid = Frame(self)
+        grid.pack(fill=BOTH, expand=True, padx=10, pady=5)
+        grid.columnconfigure((0, 1), weight=1); grid.rowconfigure((0, 1), weight=1)
+        self.gen_tree = self._table(grid, 0, 0, "最常见武将", ("武将", "阵营", "阵容数"))
+        self.pair_tree = self._table(grid, 0, 1, "最常见同阵组合", ("武将", "武将", "阵容数"))
+        self.day_tree = self._table(grid, 1, 0, "每日新阵容（最近 14 天）", ("日期", "阵容数"))
+        self.faction_tree = self._table(grid, 1, 1, "选中玩家的阵营构成", ("阵营", "武将人次", "占比"))
+        btn_f = Frame(self)
+        btn_f.pack(pady=5)
+        ttk.Button(btn_f, text="刷新", command=self.refresh).pack(side=LEFT, padx=5)
+        self.btn_rebuild = ttk.Button(btn_f, text="重建并校验", command=self.rebuild)
+        self.btn_rebuild.pack(side=LEFT, padx=5)
+        self.status = Label(self, text="", fg="#7f8c8d")
+        self.status.pack(pady=(0, 8))
+        self.refresh()
+
+    def _table(self, parent, row, col, title, heads):
+        f = Frame(parent)
+        f.grid(row=row, column=col, sticky=NSEW, padx=5, pady=5)
+        Label(f, text=title, font=("微软雅黑", 10, "bold")).pack(anchor=W)
+        tree = ttk.Treeview(f, columns=tuple(range(len(heads))), show="headings", height=10)
+        for i, h in enumerate(heads):
+            tree.heading(i, text=h)
+            tree.column(i, width=100, anchor=CENTER)
+        tree.pack(fill=BOTH, expand=True)
+        return tree
+
+    @staticmethod
+    def _fill(tree, rows):
+        tree.delete(*tree.get_children())
+        for r in rows: tree.insert("", END, values=r)
+
+    def refresh(self):
+        self._fill(self.gen_tree, self.db.top_generals())
+        self._fill(self.pair_tree, self.db.top_pairs())
+        self._fill(self.day_tree, self.db.daily_counts())
+        name = self.selected_player()
+        rows = self.db.player_factions(name) if name else []
+        total = sum(n for _, n in rows) or 1
+        self._fill(self.faction_tree, [(f, n, f"{n / total:.0%}") for f, n in rows])
+        self.status.config(text=f"玩家：{name}" if name else "在主界面选中玩家可查看其阵营构成")
+
+    def rebuild(self):
+        self.btn_rebuild.config(state=DISABLED)
+        self.status.config(text="正在从全部记录重算...")
+        def work():
+            diff = self.db.rebuild_stats()
+            self.after(0, done, diff)
+        def done(diff):
+            if not self.winfo_exists(): return
+            self.btn_rebuild.config(state=NORMAL)
+            bad = {t: n for t, n in diff.items() if n}
+            self.refresh()
+            self.status.config(text="重建完成，与增量结果一致" if not bad else f"重建完成，已修正不一致的行：{bad}")
+        threading.Thread(target=work, daemon=True).start()
+
+# ==================== 4. 屏幕采集与识别引擎 ====================
+class CapturedFrame:
+    """一次截屏的结果，各识别区域通过 crop 取得指向同一缓冲区的零拷贝视图。
+    regions 为回放帧录制时的区域配置，实时截屏时为 None（使用当前配置）"""
+    def __init__(self, buf, origin, ts=None, regions=None):
+        self.buf = buf
+        self.origin = origin
+        self.ts = time.time() if ts is None else ts
+        self.regions = regions
+
+    def crop(self, region):
+        if not region: return None
+        x, y = region[0] - self.origin[0], region[1] - self.origin[1]
+        return self.buf[y:y + region[3], x:x + region[2]]
+
+# 参与识别的区域配置键，录制与回放都按这几项保存/还原
+REGION_KEYS = ("icon_reg", "name_reg", "block_reg", "gen_regs")
+
+def region_list(regions):
+    """区域配置 -> 需要截取的全部矩形"""
+    return [regions.get("icon_reg"), regions.get("name_reg"), regions.get("block_reg")] + list(regions.get("gen_regs") or [])
+
+class CaptureSource(ABC):
+    """采集源接口：grab(regions) 返回一帧 CapturedFrame，取不到时返回 None"""
+    exhausted = False
+
+    @abstractmethod
+    def grab(self, regions):
+        ...
+
+    def close(self):
+        pass
+
+class ScreenSource(CaptureSource):
+    """每个监控周期只截一次屏：截取所有已配置区域的外接矩形"""
+    @staticmethod
+    def union_bbox(regions):
+        regions = [r for r in regions if r]
+        if not regions: return None
+        return (min(r[0] for r in regions), min(r[1] for r in regions),
+                max(r[0] + r[2] for r in regions), max(r[1] + r[3] for r in regions))
+
+    def grab(self, regions):
+        bbox = self.union_bbox(regions)
+        if not bbox: return None
+        try:
+            return CapturedFrame(np.asarray(ImageGrab.grab(bbox=bbox)), bbox[:2])
+        except Exception as e:
+            METRICS.error("capture", e)
+            return None
+
+class FrameRecorder(CaptureSource):
+    """包装另一个采集源，边监控边把各识别区域的像素存盘（区域外置零），供 ReplaySource 离线回放。
+    目录结构：frames.jsonl 每帧一行（文件名、时间戳、原点、区域配置）；画面与上一帧相同时复用上一张 PNG"""
+    def __init__(self, source, out_dir, config):
+        self.source, self.out_dir, self.config = source, out_dir, config
+        os.makedirs(out_dir, exist_ok=True)
+        self._index = open(os.path.join(out_dir, "frames.jsonl"), "a", encoding="utf-8")
+        self._seq = sum(1 for n in os.listdir(out_dir) if n.endswith(".png"))
+        self._last = None
+
+    def grab(self, regions):
+        frame = self.source.grab(regions)
+        if frame is not None:
+            try: self._record(frame)
+            except Exception as e: METRICS.error("record", e)
+        return frame
+
+    def _record(self, frame):
+        rec = {k: self.config.get(k) for k in REGION_KEYS}
+        canvas = np.zeros_like(frame.buf)
+        for r in region_list(rec):
+            if not r: continue
+            x, y = r[0] - frame.origin[0], r[1] - frame.origin[1]
+            canvas[y:y + r[3], x:x + r[2]] = frame.buf[y:y + r[3], x:x + r[2]]
+        if self._last is None or self._last[1].shape != canvas.shape or not np.array_equal(self._last[1], canvas):
+            self._seq += 1
+            name = f"{self._seq:06d}.png"
+            cv2.imencode(".png", cv2.cvtColor(canvas, cv2.COLOR_RGB2BGR))[1].tofile(os.path.join(self.out_dir, name))
+            self._last = (name, canvas)
+        self._index.write(json.dumps({"file": self._last[0], "ts": frame.ts, "origin": list(frame.origin), "regions": rec},
+                                     ensure_ascii=False) + "\n")
+        self._index.flush()
+
+    def close(self):
+        self._index.close()
+        self.source.close()
+
+class ReplaySource(CaptureSource):
+    """按录制顺序逐帧回放 FrameRecorder 的目录，不需要屏幕；放完后 exhausted 为 True、grab 返回 None。
+    labels.json（可选）为人工校对的真值：{文件名: {"player": 玩家名, "generals": [三名武将]}}"""
+    def __init__(self, rec_dir, loop=1):
+        self.rec_dir = rec_dir
+        with open(os.path.join(rec_dir, "frames.jsonl"), encoding="utf-8") as f:
+            self.entries = [json.loads(line) for line in f if line.strip()]
+        labels_path = os.path.join(rec_dir, "labels.json")
+        self.labels = {}
+        if os.path.exists(labels_path):
+            with open(labels_path, encoding="utf-8") as f: self.labels = json.load(f)
+        self._order = itertools.chain.from_iterable(itertools.repeat(self.entries, loop))
+        self._last = (None, None)
+        self.current = None
+
+    def _image(self, name):
+        # 连续相同的帧在录制时共用一张 PNG，只需缓存上一张
+        if self._last[0] != name:
+            img = cv2.imdecode(np.fromfile(os.path.join(self.rec_dir, name), dtype=np.uint8), cv2.IMREAD_COLOR)
+            self._last = (name, cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+        return self._last[1]
+
+    def frame(self, entry):
+        return CapturedFrame(self._image(entry["file"]), tuple(entry["origin"]), entry["ts"], entry["regions"])
+
+    def grab(self, regions):
+        self.current = next(self._order, None)
+        if self.current is None:
+            self.exhausted = True
+            return None
+        return self.frame(self.current)
+
+    @property
+    def label(self):
+        """当前帧的真值标注，没有标注时为 None"""
+        return self.labels.get(self.current["file"]) if self.current else None
+
+class ChangeGate:
+    """按区域缓存上一帧的缩略签名与结果：像素基本未变时直接复用上次结果，不再重复 OCR。
+    多张区域图逐张比较，任一张的变化像素占比超过 ratio_tol 即视为变化，小区域的变化不会被其它区域摊薄"""
+    def __init__(self, pixel_tol=24, ratio_tol=0.005, size=(64, 16)):
+        self.pixel_tol, self.ratio_tol, self.size = pixel_tol, ratio_tol, size
+        self._cache = {}
+
+    def _signature(self, imgs):
+        sigs = [cv2.resize(cv2.cvtColor(img, cv2.COLOR_RGB2GRAY), self.size, interpolation=cv2.INTER_AREA)
+                if img is not None and img.size else np.zeros(self.size[::-1], np.uint8) for img in imgs]
+        return np.stack(sigs).astype(np.int16)
+
+    def cached(self, key, imgs, compute):
+        """返回 (结果, 是否变化)；imgs 可以是单张或多张区域图"""
+        if not isinstance(imgs, (list, tuple)): imgs = [imgs]
+        sig = self._signature(imgs)
+        prev = self._cache.get(key)
+        if prev is not None and prev[0].shape == sig.shape and \
+                (np.abs(prev[0] - sig) > self.pixel_tol).mean(axis=(1, 2)).max() <= self.ratio_tol:
+            return prev[1], False
+        result = compute(*imgs)
+        self._cache[key] = (sig, result)
+        return result, True
+
+    def reset(self):
+        self._cache.clear()
+
+# --- 预处理 ---
+# 每类区域（玩家名 name / 武将 gen）各自一份：mode 为 gray 或 binary（Otsu 二值化，统一成白底黑字）；
+# trim 裁掉无字的边，"x" 只裁左右、"xy" 上下也裁；text_height > 0 时按实测字高缩放到该高度，否则按固定 scale 缩放
+PREPROCESS_DEFAULTS = {"mode": "gray", "trim": "", "text_height": 0, "scale": 1.0}
+
+class Preprocessor:
+    """单类区域的预处理。灰度/二值/缩放的输出写进按尺寸复用的缓冲区，稳态下不再分配整图内存；
+    返回值是缓冲区的视图，下一次调用前须用完（拷进画布或共享内存），因此每个区域槽位各用一个实例"""
+    INK_TOL = 48   # 一行/一列的最大最小灰度差超过它才算有字
+    PAD = 2
+
+    def __init__(self, mode="gray", trim="", text_height=0, scale=1.0, max_scale=3.0):
+        self.mode, self.trim, self.text_height, self.scale, self.max_scale = mode, trim, text_height, scale, max_scale
+        self._bufs = {}
+
+    @classmethod
+    def from_cfg(cls, cfg):
+        return cls(**{k: cfg[k] for k in PREPROCESS_DEFAULTS if k in cfg})
+
+    def _buf(self, tag, shape):
+        buf = self._bufs.get(tag)
+        if buf is None or buf.shape != shape:
+            buf = self._bufs[tag] = np.empty(shape, np.uint8)
+        return buf
+
+    @classmethod
+    def _ink_span(cls, profile):
+        idx = np.flatnonzero(profile > cls.INK_TOL)
+        return (int(idx[0]), int(idx[-1]) + 1) if idx.size else None
+
+    def __call__(self, img):
+        h, w = img.shape[:2]
+        out = self._buf("grey", (h, w))
+        cv2.cvtColor(img, cv2.COLOR_RGB2GRAY, dst=out)
+        if self.mode == "binary":
+            cv2.threshold(out, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU, dst=out)
+            if cv2.mean(out)[0] < 127: cv2.bitwise_not(out, dst=out)
+        rows = self._ink_span(out.max(axis=1) - out.min(axis=1)) if self.trim or self.text_height else None
+        if self.trim and rows:
+            cols = self._ink_span(out.max(axis=0) - out.min(axis=0)) or (0, w)
+            x0, x1 = max(cols[0] - self.PAD, 0), min(cols[1] + self.PAD, w)
+            y0, y1 = (max(rows[0] - self.PAD, 0), min(rows[1] + self.PAD, h)) if self.trim == "xy" else (0, h)
+            out = out[y0:y1, x0:x1]
+        # 字高取有字行的跨度；整块无字时不缩放
+        scale = (self.text_height / (rows[1] - rows[0]) if rows else 1.0) if self.text_height else self.scale
+        scale = min(max(scale, 1 / self.max_scale), self.max_scale)
+        if abs(scale - 1) > 0.05:
+            sh, sw = max(int(out.shape[0] * scale), 1), max(int(out.shape[1] * scale), 1)
+            dst = self._buf("scaled", (sh, sw))
+            cv2.resize(out, (sw, sh), dst=dst, interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+            out = dst
+        return out
+
+# --- OCR 后端 ---
+class OCRBackend(ABC):
+    """OCR 后端接口：readtext 为检测+识别，recognize 为已知文本框的纯识别（框格式 [x_min, x_max, y_min, y_max]）"""
+    name = ""
+
+    @abstractmethod
+    def load(self):
+        ...
+
+    @abstractmethod
+    def readtext(self, img):
+        ...
+
+    @abstractmethod
+    def recognize(self, grey, boxes):
+        """返回 [(box, text, conf), ...]"""
+
+class EasyOCRBackend(OCRBackend):
+    """原版 EasyOCR。CPU 上 Reader 默认（quantize=True）已对识别网络的 LSTM / 全连接层做了 int8 动态量化"""
+    name = "easyocr"
+
+    def load(self):
+        self.reader = easyocr.Reader(['ch_sim', 'en'], gpu=False)
+
+    def readtext(self, img):
+        return self.reader.readtext(img)
+
+    def recognize(self, grey, boxes):
+        return self.reader.recognize(grey, horizontal_list=boxes, free_list=[], batch_size=len(boxes))
+
+class FastCPUEasyOCRBackend(EasyOCRBackend):
+    """同一套识别权重的 CPU 优化版：在原版（LSTM / 全连接层已由 EasyOCR 动态量化）的基础上，
+    把卷积特征提取冻结为 TorchScript 图并做推理优化（算子融合）。耗时主要在卷积，实测约快 1.5 倍"""
+    name = "easyocr_fast"
+
+    def load(self):
+        super().load()
+        torch = importlib.import_module("torch")
+        model = getattr(self.reader.recognizer, "module", self.reader.recognizer).eval()
+        with torch.no_grad():
+            if hasattr(model, "FeatureExtraction"):
+                sample = torch.zeros(1, 1, 64, 256)
+                traced = torch.jit.trace(model.FeatureExtraction, sample).eval()
+                model.FeatureExtraction = torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+OCR_BACKENDS = {b.name: b for b in (EasyOCRBackend, FastCPUEasyOCRBackend)}
+
+# --- 多进程识别池 ---
+def _ocr_worker_main(backend_name, tasks, results):
+    """识别工作进程：各自持有一份已加载的模型，从共享内存读取单行灰度图做纯识别"""
+    try:
+        backend = OCR_BACKENDS[backend_name]()
+        backend.load()
+        backend.recognize(np.full((34, 160), 255, dtype=np.uint8), [[0, 160, 0, 34]])
+        results.put(("ready", os.getpid(), ""))
+    except Exception as e:
+        results.put(("failed", os.getpid(), str(e)))
+        return
+    while True:
+        task = tasks.get()
+        if task is None: break
+        key, shm_name, (h, w) = task
+        text, err = "", None
+        try:
+            shm = shared_memory.SharedMemory(name=shm_name)  # 由主进程创建并回收
+            try: text = "".join(r[1] for r in backend.recognize(np.ndarray((h, w), np.uint8, buffer=shm.buf), [[0, w, 0, h]]))
+            finally: shm.close()
+        except Exception as e: err = f"{type(e).__name__}: {e}"
+        results.put((key, err, text))
+
+class OCRWorkerPool:
+    """N 个识别进程（spawn 启动，只在引擎初始化时付出一次加载开销）。
+    每个区域的灰度图写入一块共享内存，任务里只传名字和尺寸；结果按 (批次, 槽位) 放回原位"""
+    def __init__(self, backend_name, workers):
+        ctx = multiprocessing.get_context("spawn")
+        self.tasks, self.results = ctx.Queue(), ctx.Queue()
+        self.procs = [ctx.Process(target=_ocr_worker_main, args=(backend_name, self.tasks, self.results), daemon=True)
+                      for _ in range(workers)]
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._job_ids = itertools.count()
+
+    def start(self, timeout=300):
+        """等待每个进程回报加载结果；进程未回报就退出（如被系统杀掉）或 timeout 秒内没全部就绪时关闭进程池并报错"""
+        for p in self.procs: p.start()
+        deadline = time.monotonic() + timeout
+        ready = 0
+        while ready < len(self.procs):
+            try:
+                status, pid, detail = self.results.get(timeout=1.0)
+            except queue.Empty:
+                dead = [p for p in self.procs if not p.is_alive()]
+                if not dead and time.monotonic() < deadline: continue
+                self.close()
+                if dead: raise RuntimeError(f"识别进程 {dead[0].pid} 启动失败: 进程已退出（exitcode={dead[0].exitcode}）")
+                raise RuntimeError(f"识别进程启动失败: {timeout} 秒内未就绪")
+            if status == "failed":
+                self.close()
+                raise RuntimeError(f"识别进程 {pid} 启动失败: {detail}")
+            ready += 1
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+
+    def _collect(self):
+        while True:
+            key, err, text = self.results.get()
+            if key is None: break
+            if err: METRICS.error("ocr_worker", err)
+            with self._lock: fut = self._pending.pop(key, None)
+            if fut: fut.set_result(text)
+
+    def read_lines(self, greys, timeout=30):
+        job = next(self._job_ids)
+        blocks, futs = [], []
+        try:
+            for slot, g in enumerate(greys):
+                shm = shared_memory.SharedMemory(create=True, size=max(g.size, 1))
+                np.ndarray(g.shape, np.uint8, buffer=shm.buf)[:] = g
+                blocks.append(shm)
+                fut = Future()
+                with self._lock: self._pending[(job, slot)] = fut
+                futs.append(fut)
+                self.tasks.put(((job, slot), shm.name, g.shape))
+            return [f.result(timeout) for f in futs]
+        finally:
+            with self._lock:
+                for slot in range(len(greys)): self._pending.pop((job, slot), None)
+            for shm in blocks: shm.close(); shm.unlink()
+
+    def close(self):
+        for _ in self.procs: self.tasks.put(None)
+        for p in self.procs:
+            p.join(timeout=3)
+            if p.is_alive(): p.terminate()
+        self.results.put((None, None, ""))
+        if getattr(self, "_collector", None): self._collector.join(timeout=3)
+
+# 预判门限：明确的帧由 OpenCV 直接判定，只有落在两阈值之间的模糊帧才回退到 OCR
+DEFAULT_GATE_CFG = {
+    "icon_template": "icon_template.png",
+    "icon_hit": 0.80, "icon_miss": 0.40,      # 战报图标模板匹配相关系数
+    "ink_empty": 0.01, "ink_text": 0.06,      # 干扰区边缘像素占比
+}
+
 class RecognitionEngine:
-    def __init__(self):
-        self.reader = None
+    # 引擎就绪状态：加载模型 -> 预热 -> 就绪（或失败）
+    LOADING, WARMING, READY, FAILED = "loading", "warming", "ready", "failed"
+
+    def __init__(self, fast_mode=True, gate_cfg=None, backend="easyocr", workers=0, preprocess_cfg=None):
+        self.backend = OCR_BACKENDS.get(backend, EasyOCRBackend)()
+        # workers > 0 时额外启动识别进程池，一张战报的各区域并行识别；遮挡/图标的 OCR 兜底仍在本进程
+        self.workers, self.pool = workers, None
+        # fast_mode: 区域已由用户框定为单行文本，跳过 CRAFT 文本检测，只跑识别网络
+        self.fast_mode = fast_mode
+        self.gate_cfg = dict(DEFAULT_GATE_CFG, **(gate_cfg or {}))
+        self.set_preprocess(preprocess_cfg)
+        self._canvas = None
+        # 画布与 _report_pre 的缓冲区是共享的，本进程识别时同一时刻只能有一个线程使用
+        self._read_lock = threading.Lock()
+        self._icon_templates = {}  # 采集方案 -> 参考图标，首次用到时从磁盘加载
+        self.state, self.state_detail = self.LOADING, ""
+        self.ready_event = threading.Event()
+        self._listeners = []
         threading.Thread(target=self._init_ocr, daemon=True).start()
 
+    @property
+    def ready(self):
+        return self.state == self.READY
+
+    def add_state_listener(self, callback):
+        """callback(state, detail) 在后台线程中调用；注册时立即回调一次当前状态"""
+        self._listeners.append(callback)
+        callback(self.state, self.state_detail)
+
+    def _set_state(self, state, detail=""):
+        self.state, self.state_detail = state, detail
+        for cb in list(self._listeners): cb(state, detail)
+        if state in (self.READY, self.FAILED): self.ready_event.set()
+
     def _init_ocr(self):
-        self.reader = easyocr.Reader(['ch_sim', 'en'], gpu=False)
+        try:
+            self.backend.load()
+            # 预热：首次推理会触发权重布局与内存分配，放在后台完成，避免第一张战报变慢
+            self._set_state(self.WARMING)
+            blank = np.full((34, 160), 255, dtype=np.uint8)
+            self.backend.recognize(blank, [[0, 160, 0, 34]])
+            if not self.fast_mode: self.backend.readtext(blank)
+            if self.workers > 0:
+                pool = OCRWorkerPool(self.backend.name, self.workers)
+                pool.start()
+                self.pool = pool
+            self._set_state(self.READY)
+        except Exception as e:
+            self._set_state(self.FAILED, str(e))
+
+    def set_preprocess(self, preprocess_cfg=None):
+        """preprocess_cfg: {"name": {...}, "gen": {...}}，缺省项见 PREPROCESS_DEFAULTS。
+        完整模式默认放大 2 倍，供文本检测网络使用"""
+        base = dict(PREPROCESS_DEFAULTS, scale=1.0 if self.fast_mode else 2.0)
+        self.preprocess_cfg = {k: dict(base, **(preprocess_cfg or {}).get(k, {})) for k in ("name", "gen")}
+        # 玩家名 + 三个武将槽位各一个实例，缓冲区互不覆盖
+        self._report_pre = [Preprocessor.from_cfg(self.preprocess_cfg["name"])] + \
+                           [Preprocessor.from_cfg(self.preprocess_cfg["gen"]) for _ in range(3)]
 
     def _clean_text(self, text):
         for k, v in OCR_CORRECTIONS.items(): text = text.replace(k, v)
         return text
 
-    def has_any_text(self, region):
-        if not self.reader or not region: return False
+    def _icon_template_path(self, key):
+        """key 为采集方案名；默认方案沿用 icon_template.png，其它方案为 icon_template@方案名.png"""
+        if not key: return self.gate_cfg["icon_template"]
+        base, ext = os.path.splitext(self.gate_cfg["icon_template"])
+        return f"{base}@{profile_file_name(key)}{ext}"
+
+    def _icon_template(self, key):
+        if key not in self._icon_templates:
+            path, tpl = self._icon_template_path(key), None
+            if os.path.exists(path):
+                try: tpl = cv2.cvtColor(cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+                except Exception as e: METRICS.error("icon_template", e)
+            self._icon_templates[key] = tpl
+        return self._icon_templates[key]
+
+    def _save_icon_template(self, img, key):
+        self._icon_templates[key] = img.copy()
+        try: cv2.imencode(".png", cv2.cvtColor(img, cv2.COLOR_RGB2BGR))[1].tofile(self._icon_template_path(key))
+        except Exception as e: METRICS.error("icon_template", e)
+
+    def reset_icon_template(self, key=""):
+        """战报区域重新框选后，旧的参考图标随之失效"""
+        self._icon_templates[key] = None
+        path = self._icon_template_path(key)
+        if os.path.exists(path): os.remove(path)
+
+    @staticmethod
+    def ink_density(img):
+        return float(np.count_nonzero(cv2.Canny(cv2.cvtColor(img, cv2.COLOR_RGB2GRAY), 80, 200))) / img.shape[0] / img.shape[1]
+
+    def has_any_text(self, img):
+        if img is None or not img.size: return False
+        density = self.ink_density(img)
+        if density <= self.gate_cfg["ink_empty"]: return False
+        if density >= self.gate_cfg["ink_text"]: return True
+        if not self.ready: return False
         try:
-            img = ImageGrab.grab(bbox=(region[0], region[1], region[0]+region[2], region[1]+region[3]))
-            return len(self.reader.readtext(np.array(img))) > 0
-        except: return False
-
-    def check_detail_flag(self, region):
-        if not self.reader or not region: return False
+            with METRICS.timer("ocr"): return len(self.backend.readtext(img)) > 0
+        except Exception as e:
+            METRICS.error("block_gate", e)
+            return False
+
+    def check_detail_flag(self, img, key=""):
+        """战报图标是否出现；key 为采集方案名，各方案各存一张参考图标"""
+        if img is None or not img.size: return False
+        tpl = self._icon_template(key)
+        if tpl is not None and tpl.shape == img.shape:
+            score = float(cv2.matchTemplate(img, tpl, cv2.TM_CCOEFF_NORMED)[0][0])
+            if score >= self.gate_cfg["icon_hit"]: return True
+            if score <= self.gate_cfg["icon_miss"]: return False
+        if not self.ready: return False
         try:
-            img = ImageGrab.grab(bbox=(region[0], region[1], region[0]+region[2], region[1]+region[3]))
-            full_text = "".join([r[1] for r in self.reader.readtext(np.array(img))])
-            return any(word in full_text for word in ["战报", "详情", "详", "报详"])
-        except: return False
+            with METRICS.timer("ocr"): full_text = "".join([r[1] for r in self.backend.readtext(img)])
+            found = any(word in full_text for word in ["战报", "详情", "详", "报详"])
+        except Exception as e:
+            METRICS.error("icon_gate", e)
+            return False
+        # OCR 确认后把当前图标存为参考模板，之后的帧靠模板匹配即可判定
+        if found and (tpl is None or tpl.shape != img.shape): self._save_icon_template(img, key)
+        return found
+
+    def _read_full(self, img, pre):
+        with self._read_lock:
+            with METRICS.timer("preprocess"): grey = pre(img)
+            with METRICS.timer("ocr"): return "".join([r[1] for r in self.backend.readtext(grey)])
+
+    def _canvas_view(self, h, w):
+        # 画布只增不减地复用；每个文本框只裁自己的区域，其余位置的旧内容不影响识别
+        if self._canvas is None or self._canvas.shape[0] < h or self._canvas.shape[1] < w:
+            old_h, old_w = self._canvas.shape if self._canvas is not None else (0, 0)
+            self._canvas = np.empty((max(h, old_h), max(w, old_w)), np.uint8)
+        return self._canvas[:h, :w]
+
+    def read_lines(self, imgs, pres=None):
+        """免检测批量识别：各单行区域经各自的 Preprocessor 处理后纵向拼到一张灰度画布上，
+        每个区域作为一个已知文本框一次送入识别网络。pres 默认为玩家名 + 三个武将槽位。
+        默认的 Preprocessor 和本进程识别用的画布为共享缓冲区，这两种情况下各线程的调用由 _read_lock 串行执行；
+        只有开了识别进程池且调用方自带 pres 时才真正并行"""
+        if pres is not None and self.pool: return self._read_lines(imgs, pres)
+        with self._read_lock: return self._read_lines(imgs, pres)
+
+    def _read_lines(self, imgs, pres):
+        pres = pres or self._report_pre
+        valid = [i for i, img in enumerate(imgs) if img is not None and img.size]
+        texts = [""] * len(imgs)
+        if not valid: return texts
+        t = time.perf_counter()
+        greys = [pres[i](imgs[i]) for i in valid]
+        if self.pool:
+            METRICS.record("preprocess", time.perf_counter() - t)
+            with METRICS.timer("ocr"):
+                for i, text in zip(valid, self.pool.read_lines(greys)): texts[i] = text
+            return texts
+        canvas = self._canvas_view(sum(g.shape[0] for g in greys), max(g.shape[1] for g in greys))
+        boxes, slot_by_y, y = [], {}, 0
+        for i, g in zip(valid, greys):
+            h, w = g.shape
+            canvas[y:y + h, :w] = g
+            boxes.append([0, w, y, y + h]); slot_by_y[y] = i
+            y += h
+        METRICS.record("preprocess", time.perf_counter() - t)
+        with METRICS.timer("ocr"): results = self.backend.recognize(canvas, boxes)
+        for box, text, _ in results:
+            i = slot_by_y.get(int(box[0][1]))
+            if i is not None: texts[i] += text
+        return texts
+
+    def _parse_player(self, text):
+        return re.sub(r'[^\u4e00-\u9fff\w丨]', '', self._clean_text(text)) or "未知玩家"
+
+    def _parse_general(self, text):
+        return GENERAL_MATCHER.parse(text)
+
+    def recognize(self, img, is_player=False):
+        if not self.ready or img is None or not img.size: return "未知"
+        pre = self._report_pre[0 if is_player else 1]
+        try:
+            text = self.read_lines([img], [pre])[0] if self.fast_mode else self._read_full(img, pre)
+            with METRICS.timer("match"): return self._parse_player(text) if is_player else self._parse_general(text)
+        except Exception as e:
+            METRICS.error("ocr", e)
+            return "异常"
+
+    def close(self):
+        if self.pool: self.pool.close(); self.pool = None
+
+    def recognize_report(self, name_img, gen_imgs, pres=None):
+        """识别一张战报：返回 (玩家名, [武将...])。快速模式下玩家名与三名武将合为一批；
+        pres 为调用方自备的四个 Preprocessor，多线程共用引擎（须开识别进程池）时各线程各用一套"""
+        if not self.ready: return "未知", []
+        if not self.fast_mode:
+            p_name = self.recognize(name_img, True)
+            return p_name, ([self.recognize(img) for img in gen_imgs] if p_name != "未知玩家" else [])
+        try:
+            texts = self.read_lines([name_img] + list(gen_imgs), pres)
+            with METRICS.timer("match"): return self._parse_player(texts[0]), [self._parse_general(t) for t in texts[1:]]
+        except Exception as e:
+            METRICS.error("ocr", e)
+            return "未知玩家", []
+
+# ==================== 5. 监控调度 ====================
+# --- 性能计量 ---
+class StageMetrics:
+    """各阶段最近 window 次的耗时与累计错误数。record 只是一次加锁的 deque.append，
+    诊断面板关闭时几乎没有开销；分位数与直方图只在 snapshot 时计算"""
+    BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)  # 直方图桶上界，最后一桶为 >1s
+
+    def __init__(self, window=512):
+        self.window = window
+        self._lock = threading.Lock()
+        self._log = None
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._samples = defaultdict(lambda: deque(maxlen=self.window))
+            self._counts, self._errors, self._last_error = Counter(), Counter(), {}
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self._samples[stage].append(seconds)
+            self._counts[stage] += 1
+
+    @contextmanager
+    def timer(self, stage):
+        t = time.perf_counter()
+        try: yield
+        finally: self.record(stage, time.perf_counter() - t)
+
+    def error(self, stage, exc):
+        """exc 为异常对象，或子进程传回的错误描述字符串"""
+        with self._lock:
+            self._errors[stage] += 1
+            self._last_error[stage] = exc if isinstance(exc, str) else f"{type(exc).__name__}: {exc}"
+
+    def snapshot(self):
+        """{阶段: {count, p50, p90, p99, max（毫秒，基于滚动窗口）, hist, errors, last_error}}"""
+        with self._lock:
+            data = {k: sorted(v) for k, v in self._samples.items()}
+            counts, errors, last = dict(self._counts), dict(self._errors), dict(self._last_error)
+        out = {}
+        for stage in list(data) + [k for k in errors if k not in data]:
+            vals = data.get(stage, [])
+            hist = [0] * (len(self.BUCKETS_MS) + 1)
+            for v in vals: hist[bisect.bisect_left(self.BUCKETS_MS, v * 1000)] += 1
+            pct = lambda q: round(vals[min(len(vals) - 1, int(q * len(vals)))] * 1000, 2) if vals else None
+            out[stage] = {"count": counts.get(stage, 0), "p50": pct(0.5), "p90": pct(0.9), "p99": pct(0.99),
+                          "max": round(vals[-1] * 1000, 2) if vals else None, "hist": hist,
+                          "errors": errors.get(stage, 0), "last_error": last.get(stage)}
+        return out
+
+    def enable_log(self, path, max_bytes=5 * 1024 * 1024, backups=3):
+        """把 snapshot 按 JSON 行追加到 path，超过 max_bytes 轮转，保留 backups 个旧文件"""
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger = logging.getLogger("stzb.metrics")
+        logger.handlers[:] = [handler]
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        self._log = logger
+
+    def log(self, **extra):
+        if self._log:
+            self._log.info(json.dumps(dict({"ts": round(time.time(), 3), "stages": self.snapshot()}, **extra), ensure_ascii=False))
+
+METRICS = StageMetrics()
+METRICS_LOG_INTERVAL = 10.0  # 秒，写指标文件的间隔
+
+# --- 轮询调度 ---
+# 各状态的轮询周期（秒）：interval 为基础周期，连续处于同一状态时按 backoff 倍增，直到 max
+DEFAULT_SCHEDULE = {
+    "waiting":  {"interval": 0.8, "backoff": 1.3, "max": 2.5},   # 等待战报出现
+    "visible":  {"interval": 0.5, "backoff": 1.25, "max": 1.5},  # 战报停留在屏幕上且未变化
+    "occluded": {"interval": 1.2, "backoff": 1.5, "max": 3.0},   # 识别区域被遮挡
+    "saved":    {"interval": 0.3, "backoff": 1.0, "max": 0.3},   # 刚录入一条，尽快看下一张战报
+}
 
-    def recognize(self, region, is_player=False):
-        if not self.reader or not region: return "未知"
+class MonitorScheduler:
+    """按监控状态决定下一次轮询的间隔，并扣除本周期已花费的处理时间"""
+    WAITING, VISIBLE, OCCLUDED, SAVED = "waiting", "visible", "occluded", "saved"
+
+    def __init__(self, schedule=None, min_sleep=0.05):
+        self.schedule = {k: dict(v, **(schedule or {}).get(k, {})) for k, v in DEFAULT_SCHEDULE.items()}
+        self.min_sleep = min_sleep
+        self.reset()
+
+    def reset(self):
+        self.state, self.streak = None, 0
+        self._stats = {k: {"ticks": 0, "work": 0.0, "max_work": 0.0, "sleep": 0.0, "overruns": 0} for k in self.schedule}
+
+    def next_delay(self, state, work_time):
+        self.streak = self.streak + 1 if state == self.state else 0
+        self.state = state
+        cfg = self.schedule[state]
+        interval = min(cfg["interval"] * cfg["backoff"] ** self.streak, cfg["max"])
+        delay = max(interval - work_time, self.min_sleep)
+        st = self._stats[state]
+        st["ticks"] += 1; st["work"] += work_time; st["sleep"] += delay
+        st["max_work"] = max(st["max_work"], work_time)
+        if work_time > interval: st["overruns"] += 1
+        return delay
+
+    def stats(self):
+        """每个状态的周期数、平均/最大处理耗时（毫秒）、平均休眠与超预算次数，用于调参"""
+        out = {}
+        for k, st in self._stats.items():
+            n = st["ticks"] or 1
+            out[k] = {"ticks": st["ticks"], "avg_work_ms": round(st["work"] / n * 1000, 1),
+                      "max_work_ms": round(st["max_work"] * 1000, 1), "avg_sleep_ms": round(st["sleep"] / n * 1000, 1),
+                      "overruns": st["overruns"]}
+        return out
+
+def resolve_player_name(db, name):
+    """玩家名判定，从不等待用户：白名单直接通过；最相似的旧名已在白名单时归并过去；
+    否则按识别结果（临时身份）录入，并把这对相似名记入待确认队列，由用户稍后批量处理"""
+    if db.is_trusted(name): return name
+    for ratio, old in db.find_similar_players(name):
+        if ratio < 1.0:
+            if db.is_trusted(old): return old
+            db.queue_review(name, old, ratio)
+            return name
+    return name
+
+class MonitorPipeline:
+    """一个监控周期的完整流程：截屏 -> 遮挡/图标门控 -> 识别 -> 玩家名判定 -> 入库。
+    不依赖界面，实时监控与离线回放（benchmark.py replay）共用；各阶段耗时与错误计入 METRICS"""
+    def __init__(self, engine, db, source, config, resolve_name=None, on_status=None, on_saved=None, template_key=""):
+        self.engine, self.db, self.source, self.config = engine, db, source, config
+        self.template_key = template_key
+        self.gate = ChangeGate()
+        self.resolve_name = resolve_name or (lambda name: resolve_player_name(db, name))
+        self.on_status = on_status or (lambda text, color: None)
+        self.on_saved = on_saved or (lambda name: None)
+        self.last_report = None
+
+    def reset(self):
+        self.gate.reset()
+
+    def tick(self):
+        """执行一个监控周期，返回调度状态；任何阶段抛出的异常只计数，不会终止监控线程"""
+        self.last_report = None
+        if not self.engine.ready:
+            return MonitorScheduler.WAITING
+        with METRICS.timer("tick"):
+            try: return self._tick()
+            except Exception as e:
+                METRICS.error("tick", e)
+                return MonitorScheduler.WAITING
+
+    def _tick(self):
+        mark = time.perf_counter()
+        def lap(stage):
+            nonlocal mark
+            now = time.perf_counter()
+            METRICS.record(stage, now - mark)
+            mark = now
+
+        # 每个周期只截一次屏，玩家名与三名武将保证出自同一帧
+        frame = self.source.grab(region_list(self.config)); lap("capture")
+        if frame is None: return MonitorScheduler.WAITING
+        regs = frame.regions or self.config
+
+        if regs.get("block_reg"):
+            blocked, _ = self.gate.cached("block", frame.crop(regs["block_reg"]), self.engine.has_any_text); lap("block_gate")
+            if blocked:
+                self.on_status("● 受到遮挡干扰", "#e67e22")
+                return MonitorScheduler.OCCLUDED
+
+        has_detail, _ = self.gate.cached("icon", frame.crop(regs["icon_reg"]),
+                                         lambda img: self.engine.check_detail_flag(img, self.template_key)); lap("icon_gate")
+        if not has_detail:
+            self.on_status("● 等待战报页面...", "#f1c40f")
+            return MonitorScheduler.WAITING
+
+        # 战报内容未变化时复用上次结果，跳过 OCR、入库与列表刷新
+        (p_name, teams), changed = self.gate.cached(
+            "report", [frame.crop(regs["name_reg"])] + [frame.crop(r) for r in regs["gen_regs"]],
+            lambda name_img, *gen_imgs: self.engine.recognize_report(name_img, gen_imgs))
+        lap("recognize" if changed else "report_cached")
+        self.last_report = (p_name, teams)
+        if not changed or p_name == "未知玩家": return MonitorScheduler.VISIBLE
+        final_name = self.resolve_name(p_name); lap("name")
+        # 写入由写线程异步提交，提交完成后再通知；近期录入过的同一战报不写库、不刷新列表
+        submitted = time.perf_counter()
+        fut = self.db.save_record(final_name, teams)
+        if fut is None:
+            lap("dedup")
+            self.on_status(f"● 近期已录入: {final_name}", "#2ecc71")
+            return MonitorScheduler.VISIBLE
+        def done(fut):
+            if fut.exception(): return METRICS.error("db_commit", fut.exception())
+            METRICS.record("db_commit", time.perf_counter() - submitted)
+            self.on_saved(final_name)
+        fut.add_done_callback(done); lap("save")
+        self.on_status(f"● 已录入: {final_name}", "#2ecc71")
+        return MonitorScheduler.SAVED
+
+# --- 多窗口采集方案 ---
+DEFAULT_PROFILE = "默认"
+# 方案名会拼进图标模板文件名和录制目录名，按 Windows 文件名规则校验
+PROFILE_NAME_BAD = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+RESERVED_FILE_NAMES = {"CON", "PRN", "AUX", "NUL"} | {f"{p}{i}" for p in ("COM", "LPT") for i in range(1, 10)}
+
+def profile_name_error(name):
+    """方案名不能安全地用作文件名时返回原因，否则返回 None"""
+    if PROFILE_NAME_BAD.search(name): return '不能包含 \\ / : * ? " < > | 等字符'
+    if name.strip(". ") != name or not name.strip("."): return "不能以点或空格开头、结尾"
+    if name.split(".")[0].upper() in RESERVED_FILE_NAMES: return "是系统保留的文件名"
+    if len(name) > 64: return "不能超过 64 个字符"
+    return None
+
+def profile_file_name(name):
+    """手工编辑的 config.json 可能绕过校验：不合规的方案名替换掉非法字符再用于路径"""
+    if profile_name_error(name) is None: return name
+    return ("_" + PROFILE_NAME_BAD.sub("_", name)[:63]).rstrip(". ") or "_"
+
+def empty_regions():
+    return {"icon_reg": None, "name_reg": None, "gen_regs": [], "block_reg": None}
+
+class CaptureProfile:
+    """一个被监控的游戏窗口：自己的区域配置、变化缓存（在 pipeline 中）与调度状态。
+    识别引擎与数据库写线程由所有方案共用，每多一个方案只多几 KB 的缩略签名与统计"""
+    def __init__(self, name, regions, pipeline, schedule=None):
+        self.name, self.regions, self.pipeline = name, regions, pipeline
+        self.scheduler = MonitorScheduler(schedule)
+
+    @property
+    def configured(self):
+        return bool(self.regions.get("icon_reg") and self.regions.get("name_reg") and self.regions.get("gen_regs"))
+
+def run_profiles(profiles, should_run, on_tick=None):
+    """在一个线程里公平轮询多个方案：每次执行到期最早的方案，各自按自己的调度器决定下次到期时间。
+    识别跟不上时所有方案都已到期，按到期先后轮流执行，不会有一个窗口饿死另一个；引擎只在这一个线程里调用"""
+    for p in profiles:
+        p.pipeline.reset()
+        p.scheduler.reset()
+    due = [(time.monotonic(), i) for i in range(len(profiles))]
+    heapq.heapify(due)
+    while due and should_run():
+        at, i = heapq.heappop(due)
+        wait = at - time.monotonic()
+        if wait > 0: time.sleep(wait)
+        if not should_run(): break
+        p = profiles[i]
+        t0 = time.perf_counter()
+        state = p.pipeline.tick()
+        heapq.heappush(due, (time.monotonic() + p.scheduler.next_delay(state, time.perf_counter() - t0), i))
+        if on_tick: on_tick(p, state)
+
+# --- 截图批量导入 ---
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".bmp")
+
+class BatchIngestor:
+    """无界面批量识别战报截图：解码/裁剪/预处理在 threads 个线程里并行，识别交给引擎的进程池，
+    写库由写线程异步提交，三段互相重叠。同时在途的文件数有上限，内存占用与文件总数无关。
+    截图按 regions（config.json 中某个方案的区域，屏幕坐标）裁剪，须与框选时同分辨率；不做图标/遮挡门控"""
+    def __init__(self, engine, db, regions, threads=4):
+        self.engine, self.db, self.regions, self.threads = engine, db, regions, threads
+        self._local = threading.local()
+
+    def _pres(self):
+        pres = getattr(self._local, "pres", None)
+        if pres is None:
+            cfg = self.engine.preprocess_cfg
+            pres = self._local.pres = [Preprocessor.from_cfg(cfg["name"])] + [Preprocessor.from_cfg(cfg["gen"]) for _ in range(3)]
+        return pres
+
+    def _recognize(self, path):
+        with METRICS.timer("decode"):
+            img = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if img is None: raise ValueError("无法解码")
+            frame = CapturedFrame(cv2.cvtColor(img, cv2.COLOR_BGR2RGB), (0, 0))
+        name_img = frame.crop(self.regions["name_reg"])
+        gen_imgs = [frame.crop(r) for r in self.regions["gen_regs"]]
+        if name_img is None or not name_img.size: raise ValueError("截图尺寸与框选区域不符")
+        return self.engine.recognize_report(name_img, gen_imgs, self._pres())
+
+    def run(self, paths, on_result):
+        """on_result(路径, 结果, 详情)：结果为 saved / duplicate / unreadable / error，按完成顺序回调。
+        paths 可以产出 None 表示暂无新文件（见 watch_folder），此时先处理在途结果"""
+        paths, exhausted = iter(paths), False
+        with ThreadPoolExecutor(self.threads) as pool:
+            pending = {}
+            while True:
+                while not exhausted and len(pending) < self.threads * 2:
+                    path = next(paths, StopIteration)
+                    if path is StopIteration: exhausted = True
+                    if path is None or exhausted: break
+                    pending[pool.submit(self._recognize, path)] = path
+                if not pending:
+                    if exhausted: break
+                    continue
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    self._finish(pending.pop(fut), fut, on_result)
+        self.db.flush()
+
+    def _finish(self, path, fut, on_result):
+        if fut.exception():
+            METRICS.error("decode", fut.exception())
+            return on_result(path, "error", str(fut.exception()))
+        p_name, teams = fut.result()
+        if p_name in ("未知玩家", "未知"): return on_result(path, "unreadable", "")
+        final_name = resolve_player_name(self.db, p_name)
+        detail = f"{final_name} | {' / '.join(teams)}"
+        if self.db.save_record(final_name, teams) is None: return on_result(path, "duplicate", detail)
+        on_result(path, "saved", detail)
+
+def list_images(folder):
+    return sorted(os.path.join(folder, n) for n in os.listdir(folder) if n.lower().endswith(IMAGE_EXTS))
+
+INGEST_LOG = ".stzb_ingested"
+
+def watch_folder(folder, settle=1.0, interval=2.0):
+    """持续产出文件夹中新出现的截图，每轮扫描后产出一次 None；修改时间距今不足 settle 秒的视为仍在写入，下一轮再取。
+    文件夹内 INGEST_LOG 中记录的文件（已处理完的）跳过，重启后不会重复识别"""
+    seen = set()
+    log_path = os.path.join(folder, INGEST_LOG)
+    if os.path.exists(log_path):
+        with open(log_path, encoding="utf-8") as f: seen = {line.rstrip("\n") for line in f}
+    while True:
+        now = time.time()
+        for path in list_images(folder):
+            name = os.path.basename(path)
+            if name in seen or now - os.path.getmtime(path) < settle: continue
+            seen.add(name)
+            yield path
+        yield None
+        time.sleep(interval)
+
+# ==================== 6. 主程序 ====================
+# ocr_mode: "fast" 仅识别（跳过文本检测），"full" 检测+识别
+# ocr_backend: "easyocr" 原版，"easyocr_fast" 卷积部分冻结为 TorchScript 的 CPU 优化版（见 OCR_BACKENDS）
+# ocr_workers: 并行识别进程数，0 为在本进程内批量识别
+# metrics_log: 非空时每 10 秒把各阶段耗时统计按 JSON 行写入该文件（自动轮转）
+# preprocess: 各类区域的预处理参数（见 PREPROCESS_DEFAULTS），可由 benchmark.py calibrate 生成
+# profiles: 采集方案名 -> 该游戏窗口的各识别区域；active_profile 为框选按钮当前编辑的方案
+# dedup: 同一战报（玩家 + 阵容）在 window 秒内重复出现不再写库，最多记 size 条
+DEFAULT_CONFIG = {"profiles": {DEFAULT_PROFILE: empty_regions()}, "active_profile": DEFAULT_PROFILE,
+                  "ocr_mode": "fast", "gate": {}, "schedule": {},
+                  "ocr_backend": "easyocr", "ocr_workers": 0, "metrics_log": "", "preprocess": {},
+                  "dedup": {"window": 300, "size": 4096}, "cache": {"max_mb": 32}}
+
+def load_config(path="config.json"):
+    """读取 config.json 并补齐缺省项；界面与 --ingest 共用"""
+    config = copy.deepcopy(DEFAULT_CONFIG)
+    if os.path.exists(path):
         try:
-            img = ImageGrab.grab(bbox=(region[0], region[1], region[0]+region[2], region[1]+region[3]))
-            img_np = cv2.resize(cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR), (0, 0), fx=2, fy=2)
-            results = self.reader.readtext(img_np)
-            full_text = self._clean_text("".join([r[1] for r in results]))
-            
-            if is_player: 
-                return re.sub(r'[^\u4e00-\u9fff\w丨]', '', full_text) or "未知玩家"
-            
-            faction = "未知"
-            for f, aliases in FACTION_MAP.items():
-                for a in aliases:
-                    if a in full_text: faction = f; full_text = full_text.replace(a, ""); break
-            name_part = re.sub(r'[^\u4e00-\u9fff]', '', full_text)
-            match = difflib.get_close_matches(name_part, GENERAL_POOL, n=1, cutoff=0.3)
-            return f"{faction} · {match[0] if match else (name_part or '未知')}"
-        except: return "异常"
-
-# ==================== 5. 主程序 ====================
+            with open(path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+                for k in config:
+                    if k in saved: config[k] = saved[k]
+                # 旧版配置只有一套区域，迁移为默认方案
+                if "profiles" not in saved and any(k in saved for k in REGION_KEYS):
+                    config["profiles"] = {DEFAULT_PROFILE: dict(empty_regions(), **{k: saved[k] for k in REGION_KEYS if k in saved})}
+                if config["active_profile"] not in config["profiles"]:
+                    config["active_profile"] = next(iter(config["profiles"]))
+        except: pass
+    return config
+
+def open_database(config):
+    dedup = config["dedup"]
+    return DatabaseManager(dedup_window=dedup.get("window", 300), dedup_size=dedup.get("size", 4096),
+                           cache_bytes=int(config["cache"].get("max_mb", 32) * (1 << 20)))
+
+class PlayerListModel:
+    """玩家列表数据：按最近出现时间排序，录入/删除只做增量的前移、插入与移除，搜索结果同步增量维护"""
+    def __init__(self, names=()):
+        self.term, self.hits = "", None
+        self.reset(names)
+
+    def reset(self, names):
+        # OrderedDict 末尾为最近出现的玩家
+        self._order = OrderedDict((n, None) for n in reversed(names))
+        self.view = [n for n in reversed(self._order) if self.matches(n)]
+
+    def matches(self, name):
+        return not self.term or self.term in name.lower() or (self.hits is not None and name in self.hits)
+
+    def set_filter(self, term, hits=None):
+        """hits: 由检索索引给出的命中玩家集合；为 None 时按玩家名子串过滤"""
+        self.term, self.hits = term, hits
+        self.view = [n for n in reversed(self._order) if self.matches(n)]
+
+    def touch(self, name):
+        """玩家刚被录入：移到最前"""
+        if name in self._order:
+            self._order.move_to_end(name)
+            if self.view and self.view[0] == name: return
+            if self.matches(name): self.view.remove(name)
+        else:
+            self._order[name] = None
+        if self.matches(name): self.view.insert(0, name)
+
+    def remove(self, name):
+        if name not in self._order: return
+        del self._order[name]
+        if self.matches(name): self.view.remove(name)
+
+class VirtualList:
+    """虚拟化列表：Treeview 中始终只保留一屏的行，滚动时改写这些行的内容，行数与数据量无关"""
+    def __init__(self, parent, heading, row_height=30):
+        frame = Frame(parent, bg="white")
+        frame.pack(fill=BOTH, expand=True, padx=5, pady=5)
+        self.tree = ttk.Treeview(frame, columns=("name",), show="headings", selectmode="browse")
+        self.tree.heading("name", text=heading)
+        self.scroll = ttk.Scrollbar(frame, orient=VERTICAL, command=self._on_scrollbar)
+        self.scroll.pack(side=RIGHT, fill=Y)
+        self.tree.pack(side=LEFT, fill=BOTH, expand=True)
+        self.tree.tag_configure('odd', background='#f9f9f9')
+        self.row_height = row_height
+        self.items, self.offset, self.selected = [], 0, None
+        self._rows, self._select_cb = 1, None
+        self.tree.bind("<Configure>", lambda e: self._on_resize(e.height))
+        self.tree.bind("<<TreeviewSelect>>", self._on_tree_select)
+        self.tree.bind("<MouseWheel>", lambda e: self.scroll_by(-3 if e.delta > 0 else 3, "units"))
+        self.tree.bind("<Button-4>", lambda e: self.scroll_by(-1, "units"))
+        self.tree.bind("<Button-5>", lambda e: self.scroll_by(1, "units"))
+        self.tree.bind("<Up>", lambda e: self._move_selection(-1))
+        self.tree.bind("<Down>", lambda e: self._move_selection(1))
+
+    def bind_select(self, callback):
+        self._select_cb = callback
+
+    def set_items(self, items):
+        self.items = items
+        self.offset = max(0, min(self.offset, len(items) - self._rows))
+        self._render()
+
+    def _on_resize(self, height):
+        self._rows = max(1, (height - self.row_height) // self.row_height + 1)
+        self.set_items(self.items)
+
+    def _render(self):
+        window = self.items[self.offset:self.offset + self._rows]
+        children = self.tree.get_children()
+        for i, name in enumerate(window):
+            iid = f"r{i}"
+            tag = 'odd' if (self.offset + i) % 2 else 'even'
+            if i < len(children): self.tree.item(iid, values=(name,), tags=(tag,))
+            else: self.tree.insert("", END, iid=iid, values=(name,), tags=(tag,))
+        if len(children) > len(window): self.tree.delete(*children[len(window):])
+        # 选中状态跟着玩家名走而不是跟着行走；由此触发的选择事件在 _on_tree_select 中因名字相同被忽略
+        self.tree.selection_set([f"r{window.index(self.selected)}"] if self.selected in window else [])
+        n = len(self.items) or 1
+        self.scroll.set(self.offset / n, min(1.0, (self.offset + self._rows) / n))
+
+    def _on_scrollbar(self, action, value, unit=None):
+        if action == "moveto": self.offset = int(float(value) * len(self.items))
+        else: return self.scroll_by(int(value), unit)
+        self.set_items(self.items)
+
+    def scroll_by(self, n, unit="units"):
+        self.offset += n * (self._rows if unit == "pages" else 1)
+        self.set_items(self.items)
+
+    def _move_selection(self, step):
+        if not self.items: return "break"
+        idx = self.items.index(self.selected) + step if self.selected in self.items else 0
+        idx = max(0, min(idx, len(self.items) - 1))
+        if idx < self.offset: self.offset = idx
+        elif idx >= self.offset + self._rows: self.offset = idx - self._rows + 1
+        self.select(self.items[idx])
+        return "break"
+
+    def select(self, name):
+        self.selected = name
+        self._render()
+        if self._select_cb: self._select_cb(name)
+
+    def _on_tree_select(self, event):
+        sel = self.tree.selection()
+        if not sel: return
+        name = self.name_at_iid(sel[0])
+        if name is not None and name != self.selected:
+            self.selected = name
+            if self._select_cb: self._select_cb(name)
+
+    def name_at_iid(self, iid):
+        i = self.offset + int(iid[1:])
+        return self.items[i] if i < len(self.items) else None
+
+    def name_at_y(self, y):
+        iid = self.tree.identify_row(y)
+        return self.name_at_iid(iid) if iid else None
+
 class App:
-    def __init__(self, root):
+    def __init__(self, root, record_dir=None):
         self.root = root
         self.root.title("率土情报管家 v1.2 (专业CSV版)")
         self.root.geometry("1280x800")
         self.root.configure(bg="#f5f6f7")
         
-        self.db = DatabaseManager()
-        self.engine = RecognitionEngine()
         self.config_file = "config.json"
-        self.config = {"icon_reg": None, "name_reg": None, "gen_regs": [], "block_reg": None}
+        self.config = load_config(self.config_file)
         self.is_monitoring = False
+        self._diag = None
+        self.record_dir = record_dir
+        if self.config["metrics_log"]: METRICS.enable_log(self.config["metrics_log"])
+        self.db = open_database(self.config)
+        self.engine = RecognitionEngine(fast_mode=self.config["ocr_mode"] != "full", gate_cfg=self.config["gate"],
+                                        backend=self.config["ocr_backend"], workers=self.config["ocr_workers"],
+                                        preprocess_cfg=self.config["preprocess"])
+        self.profiles = {name: self._make_profile(name) for name in self.config["profiles"]}
         
         self._set_style()
-        self._load_saved_config()
         self._build_ui()
         self.refresh_player_list()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.engine.add_state_listener(lambda st, detail: self.root.after(0, self._on_engine_state, st, detail))
+
+    def on_close(self):
+        self.is_monitoring = False
+        self.db.close()  # 等待写线程把队列中的记录提交完
+        self.engine.close()
+        for p in self.profiles.values(): p.pipeline.source.close()
+        self.root.destroy()
+
+    # --- 采集方案 ---
+    def _make_profile(self, name):
+        regions = self.config["profiles"][name]
+        # record_dir: 启动参数 --record 指定时边监控边录制各区域画面（每个方案一个子目录），供 benchmark.py replay 离线回放
+        source = ScreenSource()
+        if self.record_dir: source = FrameRecorder(source, os.path.join(self.record_dir, profile_file_name(name)), regions)
+        def on_status(text, color):
+            if len(self.profiles) > 1: text = f"[{name}] {text}"
+            self.root.after(0, lambda: self.status_label.config(text=text, fg=color))
+        # 相似玩家名不再弹窗等待：按识别结果入库并记入待确认队列（resolve_player_name），监控不受人工响应影响
+        pipeline = MonitorPipeline(self.engine, self.db, source, regions, on_status=on_status, on_saved=lambda n: self.root.after(0, self._on_record_saved, n),
+                                   template_key="" if name == DEFAULT_PROFILE else name)
+        return CaptureProfile(name, regions, pipeline, self.config["schedule"])
+
+    @property
+    def active_regions(self):
+        return self.config["profiles"][self.config["active_profile"]]
+
+    def _on_profile_selected(self, event=None):
+        self.config["active_profile"] = self.profile_var.get()
+        self._save_config()
+
+    def _refresh_profile_box(self):
+        self.profile_box["values"] = list(self.config["profiles"])
+        self.profile_var.set(self.config["active_profile"])
+
+    def add_profile(self):
+        if self.is_monitoring: return messagebox.showwarning("提醒", "请先停止监控")
+        name = simpledialog.askstring("新建采集方案", "方案名称（如账号名）：", parent=self.root)
+        name = (name or "").strip()
+        if not name: return
+        error = profile_name_error(name)
+        if error: return messagebox.showwarning("提醒", f"方案名{error}")
+        if name in self.config["profiles"]: return messagebox.showwarning("提醒", f"方案【{name}】已存在")
+        self.config["profiles"][name] = empty_regions()
+        self.profiles[name] = self._make_profile(name)
+        self.config["active_profile"] = name
+        self._save_config()
+        self._refresh_profile_box()
+
+    def delete_profile(self):
+        if self.is_monitoring: return messagebox.showwarning("提醒", "请先停止监控")
+        name = self.config["active_profile"]
+        if len(self.config["profiles"]) == 1: return messagebox.showwarning("提醒", "至少保留一个采集方案")
+        if not messagebox.askyesno("确认", f"删除采集方案【{name}】及其区域设置？"): return
+        pipeline = self.profiles.pop(name).pipeline
+        pipeline.source.close()
+        self.engine.reset_icon_template(pipeline.template_key)
+        del self.config["profiles"][name]
+        self.config["active_profile"] = next(iter(self.config["profiles"]))
+        self._save_config()
+        self._refresh_profile_box()
 
     def _set_style(self):
         style = ttk.Style()
@@ -398,15 +2561,6 @@ class App:
         style.configure("Treeview.Heading", font=("微软雅黑", 10, "bold"), background="#ecf0f1", foreground="#2c3e50")
         style.configure("Action.TButton", font=("微软雅黑", 9))
 
-    def _load_saved_config(self):
-        if os.path.exists(self.config_file):
-            try:
-                with open(self.config_file, "r", encoding="utf-8") as f:
-                    saved = json.load(f)
-                    for k in self.config:
-                        if k in saved: self.config[k] = saved[k]
-            except: pass
-
     def _save_config(self):
         with open(self.config_file, "w", encoding="utf-8") as f:
             json.dump(self.config, f, ensure_ascii=False)
@@ -421,15 +2575,29 @@ class App:
 
         btn_f = Frame(top_bar, bg="#2c3e50")
         btn_f.pack(side=LEFT, padx=10)
+
+        # 采集方案：框选按钮编辑当前方案的区域，监控时所有已框好的方案一起轮询
+        self.profile_var = StringVar()
+        self.profile_box = ttk.Combobox(btn_f, textvariable=self.profile_var, state="readonly", width=10)
+        self.profile_box.pack(side=LEFT, padx=3)
+        self.profile_box.bind("<<ComboboxSelected>>", self._on_profile_selected)
+        self._refresh_profile_box()
+        ttk.Button(btn_f, text="＋", command=self.add_profile, width=2).pack(side=LEFT)
+        ttk.Button(btn_f, text="－", command=self.delete_profile, width=2).pack(side=LEFT, padx=(0, 8))
         
         for idx, (txt, cmd) in enumerate([("1. 框战报", self.set_icon_reg), ("2. 框玩家", self.set_name_reg), 
                                         ("3. 框武将", self.set_gen_regs_auto), ("4. 框干扰", self.set_block_reg)]):
             ttk.Button(btn_f, text=txt, command=cmd, style="Action.TButton", width=10).pack(side=LEFT, padx=3)
         
         ttk.Button(btn_f, text="🛡 白名单", command=self.open_trust_mgr, width=8).pack(side=LEFT, padx=10)
+        self.btn_review = ttk.Button(btn_f, command=self.open_review_queue, width=12)
+        self.btn_review.pack(side=LEFT, padx=5)
+        self._update_review_badge()
         ttk.Button(btn_f, text="⬇ 导入数据", command=self.import_action, width=10).pack(side=LEFT, padx=5)
         ttk.Button(btn_f, text="⬆ 导出数据", command=self.export_action, width=10).pack(side=LEFT, padx=5)
         
+        ttk.Button(btn_f, text="📈 统计", command=self.show_stats, width=8).pack(side=LEFT, padx=5)
+        ttk.Button(btn_f, text="📊 诊断", command=self.show_diagnostics, width=8).pack(side=LEFT, padx=5)
         # 新增关于按钮
         ttk.Button(btn_f, text="ℹ 关于", command=self.show_about_dialog, width=8).pack(side=LEFT, padx=5)
 
@@ -453,16 +2621,18 @@ class App:
         search_f = Frame(left_f, bg="#f5f6f7", padx=10, pady=10)
         search_f.pack(fill=X)
         self.search_var = StringVar()
-        self.search_var.trace("w", lambda *args: self.refresh_player_list())
+        self._search_job = None
+        self.search_var.trace("w", lambda *args: self._schedule_search())
         search_entry = ttk.Entry(search_f, textvariable=self.search_var)
         search_entry.pack(side=LEFT, fill=X, expand=True)
         ttk.Button(search_f, text="清空", width=5, command=lambda: self.search_var.set("")).pack(side=LEFT, padx=5)
+        Label(left_f, text="搜玩家/武将/备注；阵容组合用 + 连接，如 大乔+孙权、吴+大乔", font=("微软雅黑", 8),
+              fg="#95a5a6", bg="#f5f6f7", anchor=W).pack(fill=X, padx=10)
 
-        self.player_list = ttk.Treeview(left_f, columns=("name"), show="headings", selectmode="browse")
-        self.player_list.heading("name", text="玩家库 (点击查看详情)")
-        self.player_list.pack(fill=BOTH, expand=True, padx=5, pady=5)
-        self.player_list.bind("<<TreeviewSelect>>", self.on_player_select)
-        self.player_list.bind("<Button-3>", self.show_player_menu)
+        self.player_model = PlayerListModel()
+        self.player_list = VirtualList(left_f, "玩家库 (点击查看详情)")
+        self.player_list.bind_select(self.on_player_select)
+        self.player_list.tree.bind("<Button-3>", self.show_player_menu)
         
         right_f = Frame(pw, bg="white")
         pw.add(right_f)
@@ -493,18 +2663,85 @@ class App:
     def show_about_dialog(self):
         AboutDialog(self.root)
 
+    def show_stats(self):
+        StatsDialog(self.root, self.db, lambda: self.player_list.selected)
+
+    def show_diagnostics(self):
+        if self._diag is not None and self._diag.winfo_exists(): return self._diag.lift()
+        self._diag = DiagnosticsDialog(self.root, METRICS, lambda: {p.name: p.scheduler for p in self.profiles.values()},
+                                       self.db.teams_cache)
+
     def refresh_player_list(self):
-        search_term = self.search_var.get().strip().lower()
-        self.player_list.delete(*self.player_list.get_children())
-        all_names = self.db.get_all_player_names()
-        for i, n in enumerate(all_names):
-            if not search_term or search_term in n.lower():
-                tag = 'even' if i % 2 == 0 else 'odd'
-                self.player_list.insert("", END, values=(n,), tags=(tag,))
-        self.player_list.tag_configure('odd', background='#f9f9f9')
+        """从数据库整体重载（导入、改名等批量变更后使用）；日常录入走 _on_record_saved 增量更新"""
+        self.player_model.reset(self.db.get_all_player_names())
+        self.player_list.set_items(self.player_model.view)
+
+    def _on_record_saved(self, name):
+        with METRICS.timer("ui_refresh"):
+            self.player_model.touch(name)
+            self.player_list.set_items(self.player_model.view)
+            self._update_review_badge()
+
+    def _update_review_badge(self):
+        n = self.db.review_count
+        self.btn_review.config(text=f"🔔 待确认 ({n})" if n else "🔔 待确认")
+
+    def open_review_queue(self):
+        def on_resolved(moved):
+            if moved: self._on_player_renamed(*moved)
+            self._update_review_badge()
+        ReviewQueueDialog(self.root, self.db, on_resolved)
+
+    def _on_player_renamed(self, old, new):
+        self.player_model.remove(old)
+        self.player_model.touch(new)
+        if self.player_list.selected == old: self.player_list.selected = new
+        self.player_list.set_items(self.player_model.view)
+
+    def _schedule_search(self, delay=200):
+        # 输入防抖：停止输入 delay 毫秒后才过滤
+        if self._search_job: self.root.after_cancel(self._search_job)
+        self._search_job = self.root.after(delay, self._apply_search)
+
+    def _apply_search(self):
+        """普通关键字：全文检索玩家名、武将与备注；含 + 时为阵容组合查询，如 大乔+孙权、吴+大乔"""
+        self._search_job = None
+        term = self.search_var.get().strip()
+        if not term: hits = None
+        elif re.search(r"[+＋]", term):
+            generals, faction = self._parse_composition(term)
+            hits = self.db.teams_cache.memo(("composition", tuple(generals), faction),
+                                            lambda: {r[0] for r in self.db.find_teams_by_generals(generals, faction, limit=100000)})
+        else: hits = self.db.search_players(term)
+        self.player_model.set_filter(term.lower(), hits)
+        self.player_list.offset = 0
+        self.player_list.set_items(self.player_model.view)
+
+    @staticmethod
+    def _parse_composition(term):
+        generals, faction = [], None
+        for tok in re.split(r"[+＋,，·\s]+", term):
+            if tok in FACTION_MAP: faction = tok
+            elif tok: generals.append(tok)
+        return generals, faction
+
+    ENGINE_STATUS = {
+        RecognitionEngine.LOADING: ("● OCR 模型加载中...", "#f1c40f"),
+        RecognitionEngine.WARMING: ("● OCR 模型预热中...", "#f1c40f"),
+        RecognitionEngine.READY: ("● 系统就绪", "#bdc3c7"),
+        RecognitionEngine.FAILED: ("● OCR 加载失败", "#e74c3c"),
+    }
+
+    def _on_engine_state(self, state, detail):
+        if self.is_monitoring: return
+        text, color = self.ENGINE_STATUS[state]
+        self.status_label.config(text=f"{text} {detail}".strip(), fg=color)
 
     def toggle(self):
-        if not self.config["name_reg"]: return messagebox.showwarning("提醒", "请先完成各项区域框选")
+        if not any(p.configured for p in self.profiles.values()): return messagebox.showwarning("提醒", "请先完成各项区域框选")
+        if not self.is_monitoring and not self.engine.ready:
+            return messagebox.showinfo("提醒", "OCR 模型尚未就绪，请稍候" if self.engine.state != RecognitionEngine.FAILED
+                                       else f"OCR 模型加载失败：{self.engine.state_detail}")
         self.is_monitoring = not self.is_monitoring
         if self.is_monitoring:
             self.btn_run.config(text="⏹ 停止监控", bg="#e74c3c")
@@ -512,61 +2749,21 @@ class App:
             threading.Thread(target=self.monitor_thread, daemon=True).start()
         else:
             self.btn_run.config(text="▶ 开始监控", bg="#27ae60")
-            self.status_label.config(text="● 系统就绪", fg="#bdc3c7")
+            self._on_engine_state(self.engine.state, self.engine.state_detail)
 
     def monitor_thread(self):
-        while self.is_monitoring:
-            if self.config["block_reg"] and self.engine.has_any_text(self.config["block_reg"]):
-                self.root.after(0, lambda: self.status_label.config(text="● 受到遮挡干扰", fg="#e67e22"))
-                time.sleep(1.2); continue
-
-            if self.engine.check_detail_flag(self.config["icon_reg"]):
-                p_name = self.engine.recognize(self.config["name_reg"], True)
-                if p_name != "未知玩家":
-                    teams = [self.engine.recognize(r) for r in self.config["gen_regs"]]
-                    final_name = self.handle_name_logic(p_name)
-                    self.db.save_record(final_name, teams)
-                    self.root.after(0, self.refresh_player_list)
-                    self.root.after(0, lambda: self.status_label.config(text=f"● 已录入: {final_name}", fg="#2ecc71"))
-            else:
-                self.root.after(0, lambda: self.status_label.config(text="● 等待战报页面...", fg="#f1c40f"))
-            time.sleep(1.5)
-
-    def handle_name_logic(self, name):
-        # 1. 如果新名字直接就在白名单，直接通过
-        if self.db.is_trusted(name): 
-            return name
-            
-        all_names = self.db.get_all_player_names()
-        for old in all_names:
-            ratio = difflib.SequenceMatcher(None, name, old).ratio()
-            # 2. 如果发现相似名字
-            if 0.75 <= ratio < 1.0:
-                # 【关键修复】：如果这个相似的旧名字已经由于之前的“不再询问”被列入白名单
-                # 则直接判定为该旧名字，不再弹窗
-                if self.db.is_trusted(old):
-                    return old
-                
-                # 否则，弹出对话框询问
-                dialog = SimilarityDialog(self.root, name, old)
-                self.root.wait_window(dialog)
-                if dialog.result:
-                    action, trust = dialog.result
-                    if action == "use_new":
-                        if trust: self.db.add_to_trust(name) # 以后看到这个新名不再问
-                        self.db.rename_player(old, name)
-                        return name
-                    else:
-                        if trust: self.db.add_to_trust(old)  # 以后看到类似这个旧名的都不再问
-                        return old
-                break
-        return name
+        profiles = [p for p in self.profiles.values() if p.configured]
+        last_log = [time.monotonic()]
+        def on_tick(profile, state):
+            if time.monotonic() - last_log[0] >= METRICS_LOG_INTERVAL:
+                METRICS.log(scheduler={p.name: p.scheduler.stats() for p in profiles})
+                last_log[0] = time.monotonic()
+        run_profiles(profiles, lambda: self.is_monitoring, on_tick)
 
     def show_player_menu(self, event):
-        item = self.player_list.identify_row(event.y)
-        if item:
-            self.player_list.selection_set(item)
-            name = self.player_list.item(item)["values"][0]
+        name = self.player_list.name_at_y(event.y)
+        if name is not None:
+            self.player_list.select(name)
             menu = Menu(self.root, tearoff=0)
             menu.add_command(label=f"❌ 删除玩家【{name}】", command=lambda: self.delete_player_action(name))
             menu.post(event.x_root, event.y_root)
@@ -595,7 +2792,9 @@ class App:
     def delete_player_action(self, name):
         if messagebox.askyesno("确认", f"确定彻底删除玩家【{name}】吗？"):
             self.db.delete_player(name)
-            self.refresh_player_list()
+            self.player_model.remove(name)
+            self.player_list.selected = None
+            self.player_list.set_items(self.player_model.view)
             self.team_table.delete(*self.team_table.get_children())
 
     def delete_team_action(self, thash):
@@ -606,36 +2805,48 @@ class App:
     def open_trust_mgr(self):
         TrustManager(self.root, self.db, None)
 
+    def _run_with_progress(self, title, task, on_done):
+        """task(progress, cancel) 在后台线程执行，返回 (成功, 消息)；完成后在主线程调用 on_done"""
+        dlg = ProgressDialog(self.root, title)
+        last = [0.0]
+        def progress(count, frac):
+            now = time.monotonic()
+            if frac < 1.0 and now - last[0] < 0.1: return  # 节流，避免刷屏占满 Tk 事件队列
+            last[0] = now
+            self.root.after(0, dlg.update_progress, count, frac)
+        def worker():
+            result = task(progress, dlg.cancel_event)
+            self.root.after(0, lambda: (dlg.destroy(), on_done(*result)))
+        threading.Thread(target=worker, daemon=True).start()
+
     def export_action(self):
         path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV Files", "*.csv")])
         if path:
-            success, msg = self.db.export_to_csv(path)
-            if success: messagebox.showinfo("成功", msg)
-            else: messagebox.showerror("失败", msg)
+            def done(success, msg):
+                if success: messagebox.showinfo("成功", msg)
+                else: messagebox.showerror("失败", msg)
+            self._run_with_progress("导出数据", lambda p, c: self.db.export_to_csv(path, p, c), done)
 
     def import_action(self):
         path = filedialog.askopenfilename(filetypes=[("CSV Files", "*.csv")])
         if path:
-            success, msg = self.db.import_from_csv(path)
-            if success:
+            def done(success, msg):
                 self.refresh_player_list()
                 self.team_table.delete(*self.team_table.get_children())
-                messagebox.showinfo("成功", msg)
-            else: messagebox.showerror("失败", msg)
-
-    def on_player_select(self, e):
-        sel = self.player_list.selection()
-        if not sel: return
-        p_name = self.player_list.item(sel[0])["values"][0]
-        self.team_table.delete(*self.team_table.get_children())
-        with sqlite3.connect(self.db.db_name) as conn:
-            data = conn.execute("SELECT team_json, first_seen, team_hash, note FROM teams WHERE player_name = ? ORDER BY first_seen DESC", (p_name,)).fetchall()
-            for i, (tj, tt, th, note) in enumerate(data):
-                try: t = json.loads(tj)
-                except: t = ["未知", "未知", "未知"]
+                if success: messagebox.showinfo("成功", msg)
+                elif msg.startswith("已取消"): messagebox.showwarning("已取消", msg)
+                else: messagebox.showerror("失败", msg)
+            self._run_with_progress("导入数据", lambda p, c: self.db.import_from_csv(path, p, c), done)
+
+    def on_player_select(self, p_name=None):
+        p_name = p_name or self.player_list.selected
+        if not p_name: return
+        with METRICS.timer("player_select"):
+            self.team_table.delete(*self.team_table.get_children())
+            for i, (tt, th, note, t) in enumerate(self.db.get_teams(p_name)):
                 tag = 'even' if i % 2 == 0 else 'odd'
                 self.team_table.insert("", END, values=(tt, t[0], t[1], t[2], note, th), tags=(tag,))
-        self.team_table.tag_configure('odd', background='#f9f9f9')
+            self.team_table.tag_configure('odd', background='#f9f9f9')
 
     def select_area(self):
         win = Toplevel(); win.attributes('-fullscreen', True, '-alpha', 0.25)
@@ -655,19 +2866,173 @@ class App:
         return res["v"]
 
     def set_icon_reg(self): 
-        self.root.iconify(); self.config["icon_reg"] = self.select_area(); self.root.deiconify(); self._save_config()
+        self.root.iconify(); self.active_regions["icon_reg"] = self.select_area(); self.root.deiconify(); self._save_config()
+        self.engine.reset_icon_template(self.profiles[self.config["active_profile"]].pipeline.template_key)
     def set_name_reg(self): 
-        self.root.iconify(); self.config["name_reg"] = self.select_area(); self.root.deiconify(); self._save_config()
+        self.root.iconify(); self.active_regions["name_reg"] = self.select_area(); self.root.deiconify(); self._save_config()
     def set_block_reg(self): 
-        self.root.iconify(); self.config["block_reg"] = self.select_area(); self.root.deiconify(); self._save_config()
+        self.root.iconify(); self.active_regions["block_reg"] = self.select_area(); self.root.deiconify(); self._save_config()
     def set_gen_regs_auto(self):
         self.root.iconify(); r = self.select_area(); self.root.deiconify()
         if r:
             x, y, w, h = r; uw = w // 3
-            self.config["gen_regs"] = [(x + 2 * uw, y, uw, h), (x + uw, y, uw, h), (x, y, uw, h)]
+            self.active_regions["gen_regs"] = [(x + 2 * uw, y, uw, h), (x + uw, y, uw, h), (x, y, uw, h)]
             self._save_config()
 
+def startup_probe(root, app):
+    """供 benchmark.py startup 使用：以 JSON 输出窗口首次绘制与首次识别完成的时间戳后退出"""
+    root.update()
+    marks = {"window": time.time()}
+    def poll():
+        if not app.engine.ready_event.is_set(): return root.after(20, poll)
+        if app.engine.ready:
+            blank = np.full((34, 163, 3), 255, dtype=np.uint8)
+            app.engine.recognize_report(blank, [blank] * 3)
+            marks["first_recognition"] = time.time()
+        else: marks["error"] = app.engine.state_detail
+        print(json.dumps(marks), flush=True)
+        app.on_close()
+    root.after(0, poll)
+
+def ingest_main(argv):
+    """stzb.py --ingest [截图或文件夹 ...] [--watch 文件夹]：不开窗口，批量识别截图写入数据库"""
+    parser = argparse.ArgumentParser(prog="stzb.py --ingest", description="批量识别战报截图并写入数据库")
+    parser.add_argument("inputs", nargs="*", help="截图文件或文件夹")
+    parser.add_argument("--watch", help="持续监视该文件夹中新出现的截图，Ctrl+C 结束")
+    parser.add_argument("--profile", help="按哪个采集方案的区域裁剪截图（默认当前方案）")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1), help="识别进程数")
+    parser.add_argument("--threads", type=int, default=4, help="解码/预处理线程数")
+    parser.add_argument("--config", default="config.json")
+    args = parser.parse_args(argv)
+    if not args.inputs and not args.watch: parser.error("需要截图、文件夹或 --watch")
+
+    config = load_config(args.config)
+    profile = args.profile or config["active_profile"]
+    if profile not in config["profiles"]: parser.error(f"没有采集方案【{profile}】")
+    regions = config["profiles"][profile]
+    gen_regs = regions.get("gen_regs") or []
+    if not (regions.get("name_reg") and len(gen_regs) == 3 and all(gen_regs)):
+        parser.error(f"方案【{profile}】的区域尚未框选完整（需要玩家名区域和 3 个武将区域）")
+
+    paths = []
+    for item in args.inputs:
+        paths.extend(list_images(item) if os.path.isdir(item) else [item])
+    if args.watch: paths = itertools.chain(paths, watch_folder(args.watch))
+
+    db = open_database(config)
+    # 批量模式固定快速识别；多线程共用引擎，识别必须走进程池
+    engine = RecognitionEngine(fast_mode=True, backend=config["ocr_backend"], workers=max(1, args.workers),
+                               preprocess_cfg=config["preprocess"])
+    engine.ready_event.wait()
+    if not engine.ready:
+        print(f"识别引擎加载失败：{engine.state_detail}")
+        db.close()
+        return 1
+
+    counts, t0 = Counter(), time.perf_counter()
+    log = open(os.path.join(args.watch, INGEST_LOG), "a", encoding="utf-8") if args.watch else None
+    def on_result(path, status, detail):
+        counts[status] += 1
+        print(f"[{status}] {os.path.basename(path)} {detail}", flush=True)
+        if log and os.path.dirname(os.path.abspath(path)) == os.path.abspath(args.watch):
+            log.write(os.path.basename(path) + "\n"); log.flush()
+    try:
+        BatchIngestor(engine, db, regions, args.threads).run(paths, on_result)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if log: log.close()
+        engine.close()
+        db.close()
+    elapsed = time.perf_counter() - t0
+    total = sum(counts.values())
+    print(f"共 {total} 张：入库 {counts['saved']}，重复 {counts['duplicate']}，未识别 {counts['unreadable']}，"
+          f"出错 {counts['error']}；用时 {elapsed:.1f}s，{total / elapsed * 60 if elapsed else 0:.0f} 张/分钟")
+    return 0
+
+def make_query_server(service, host="127.0.0.1", port=8765, unix_socket=None):
+    """HTTP/1.1（长连接）的只读查询接口，每个连接一个线程；unix_socket 给出路径时改为监听 Unix 域套接字。
+    GET /teams、/players、/player 的参数见 QueryService 同名方法，返回 JSON；GET /stats 为缓存统计"""
+    class Handler(http_server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True  # 响应头与正文分两次写出，不关 Nagle 会撞上客户端的延迟确认，每次请求多等 40ms
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            route = url.path.strip("/")
+            try:
+                if route == "stats":
+                    body = dict(self.server.service.cache.stats(), db=self.server.service.db_name)
+                else:
+                    body = self.server.service.query(route, parse_qs(url.query))
+                    if body is None: return self._send(404, {"error": "没有该玩家"})
+            except KeyError: return self._send(404, {"error": f"未知接口 /{route}"})
+            except (ValueError, sqlite3.OperationalError) as e: return self._send(400, {"error": str(e)})
+            self._send(200, body)
+
+        def _send(self, status, body):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def address_string(self):
+            return str(self.client_address[0]) if self.client_address else "unix"
+
+        def log_message(self, fmt, *args):
+            pass
+
+    if unix_socket:
+        import socketserver
+        if os.path.exists(unix_socket): os.remove(unix_socket)
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+        Handler.disable_nagle_algorithm = False  # 仅对 TCP 有效
+        server = Server(unix_socket, Handler)
+    else:
+        server = http_server.ThreadingHTTPServer((host, port), Handler)
+    server.service = service
+    return server
+
+def serve_main(argv):
+    """stzb.py --serve [--port 8765 | --unix 路径]：不开窗口，对本机提供情报库的只读查询，可与主程序同时运行"""
+    parser = argparse.ArgumentParser(prog="stzb.py --serve", description="情报库只读查询服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="改为监听该 Unix 域套接字")
+    parser.add_argument("--db", default="rate_of_land.db", help="数据库文件")
+    parser.add_argument("--pool", type=int, default=8, help="只读连接数")
+    parser.add_argument("--cache", type=int, default=2048, help="缓存的查询结果条数")
+    args = parser.parse_args(argv)
+
+    db_name = args.db
+    if not os.path.exists(db_name): parser.error(f"数据库不存在：{db_name}")
+    # 服务本身只读；旧版本的库先补齐表结构与索引（一次性写入）
+    DatabaseManager(db_name).close()
+    server = make_query_server(QueryService(db_name, args.pool, args.cache), args.host, args.port, args.unix)
+    print(f"查询服务已启动：{args.unix or f'http://{args.host}:{args.port}'}（{db_name}），Ctrl+C 结束", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # 打包后的 exe 需要，用于识别进程池
+    if "--ingest" in sys.argv: sys.exit(ingest_main(sys.argv[sys.argv.index("--ingest") + 1:]))
+    if "--serve" in sys.argv: sys.exit(serve_main(sys.argv[sys.argv.index("--serve") + 1:]))
+    if "--rebuild-stats" in sys.argv:
+        # 从全部记录重算统计表，输出与增量维护结果不一致的行数（全为 0 即一致）
+        db = DatabaseManager()
+        print(json.dumps(db.rebuild_stats(), ensure_ascii=False))
+        db.close()
+        sys.exit(0)
     tk_root = Tk()
-    app = App(tk_root)
+    record_dir = sys.argv[sys.argv.index("--record") + 1] if "--record" in sys.argv[:-1] else None
+    app = App(tk_root, record_dir)
+    if "--startup-probe" in sys.argv: startup_probe(tk_root, app)
     tk_root.mainloop()
\ No newline at end of file
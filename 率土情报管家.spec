@@ -4,7 +4,7 @@ from PyInstaller.utils.hooks import collect_all
 
 datas = [('武将列表.txt', '.')]
 binaries = []
-hiddenimports = []
+hiddenimports = ['PIL.ImageGrab', 'numpy']
 hiddenimports += collect_submodules('cv2')
 tmp_ret = collect_all('easyocr')
 datas += tmp_ret[0]; binaries += tmp_ret[1]; hiddenimports += tmp_ret[2]